@@ -26,6 +26,21 @@
  *     6: checksum / execution error (0: no error, 1: error)
  *     7: uneven bit - force number of bits = 1 of confirm byte to be uneven
  *     
+ * REPORT - Frame (one block write of 9 bytes, sets the complete key state):
+ *   REPORT-ID (0b11111111), MODIFIER, KEY 1-6 (HID usage ids, 0 = unused),
+ *   CHECK:
+ *     0-5: Checksum summing all bits = 1 of MODIFIER and KEY 1-6
+ *       6: Set connect LED (0 turn LED off, 1 turn LED on)
+ *       7: uneven bit - force number of bits = 1 of CHECK to be uneven
+ *   The following read returns a CONFIRM byte with the checksum of
+ *   MODIFIER, KEY 1-6 and CHECK in bits 0-3.
+ *
+ * COMBINED - Transaction (I2C_RDWR, write - repeated start - read):
+ *   KEY-ID and ACTION (or a REPORT frame) may be written in the same
+ *   transaction as the CONFIRM read. The Wire library calls receiveData
+ *   with all written bytes at the repeated start, before sendData is
+ *   requested, so it is handled like separate writes followed by a read.
+ *     
  */
 
 #include <Wire.h>  // do manually: globally disable digitalWrite(SDA, 1) 
@@ -39,10 +54,16 @@
 const byte CONNECT_LED = 13; // 13: Arduino Micro onboard LED
 const byte HARDWARE_SWITCH = 4;
 const byte DEVICE_ID = 0b10000010; // when reading befor sending, return this ID
+const byte REPORT_ID = 0b11111111; // first byte of a report frame
+const byte REPORT_LENGTH = 8;      // MODIFIER, KEY 1-6, CHECK
 
 byte keyid = 0;
 byte action = 0;
 
+byte report[REPORT_LENGTH];
+byte report_confirm = 0;
+boolean report_received = false;
+
 boolean status_hardware_switch = false;
 boolean nothing_received_since_restart = true;
 
@@ -100,6 +121,73 @@ byte check() {
   return confirmsum;
 }
 
+/*
+ * applyReport
+ * check the received report frame and replace the complete key state of
+ * the keyboard with it in one HID report
+ * return: confirmation byte
+ */
+byte applyReport() {
+  byte checkinput = 0;
+  for(int n = 0; n < REPORT_LENGTH - 1; n++) {
+    checkinput += bitSum(report[n]);
+  }
+  byte check = report[REPORT_LENGTH - 1];
+
+  byte confirmsum = (checkinput + bitSum(check)) & 0b00001111;
+
+  // look for transmission errors by checking checkinput sum of bits and 
+  // confirming that number of bits = 1 of CHECK is uneven
+  if(checkinput != (check & 0b00111111)) {
+    bitSet(confirmsum, 6);
+  }
+  else if(bitRead(bitSum(check), 0) == 0) {
+    bitSet(confirmsum, 6);
+  }
+
+  if(bitRead(confirmsum, 6) == 0) {
+    // Keyboardaction is allways limited by the hardware switch
+    if(digitalRead(HARDWARE_SWITCH) == HIGH) {
+      Keyboard.removeAll();
+      for(int n = 0; n < 8; n++) {
+        if(bitRead(report[0], n)) {
+          Keyboard.add(KeyboardKeycode(KEY_LEFT_CTRL + n));
+        }
+      }
+      for(int n = 1; n < REPORT_LENGTH - 1; n++) {
+        if(report[n] != 0) {
+          Keyboard.add(KeyboardKeycode(report[n]));
+        }
+      }
+      Keyboard.send();
+    }
+
+    // set connect LED
+    if(bitRead(check, 6) == 0) {
+      digitalWrite(CONNECT_LED, LOW);
+    } else {
+      digitalWrite(CONNECT_LED, HIGH);
+    }
+  }
+
+  // include status of hardware switch
+  if(digitalRead(HARDWARE_SWITCH) == HIGH) {
+    bitSet(confirmsum, 5);
+  }
+
+  // include status of connect LED
+  if(digitalRead(CONNECT_LED) == HIGH) {
+    bitSet(confirmsum, 4);
+  }
+
+  // set uneven bit
+  if(bitRead(bitSum(confirmsum), 0) == 0) {
+    bitSet(confirmsum, 7);
+  }
+
+  return confirmsum;
+}
+
 /*
  * setup
  * setup the base parameters and initialize communication (i2c)
@@ -140,6 +228,20 @@ void loop() {
  * 
  */
 void receiveData(int byteCount){
+  // report frame: read and apply the complete key state at once
+  if(byteCount == REPORT_LENGTH + 1 && Wire.peek() == REPORT_ID) {
+    Wire.read();
+    for(int n = 0; n < REPORT_LENGTH; n++) {
+      report[n] = Wire.read();
+    }
+    report_confirm = applyReport();
+    report_received = true;
+    nothing_received_since_restart = false;
+    return;
+  }
+
+  report_received = false;
+  // one byte per write or KEY-ID and ACTION in one combined write
   while(Wire.available()) {
     keyid = action;
     action = Wire.read();
@@ -159,6 +261,14 @@ void sendData(){
     return;
   }
 
+  // confirm a received report frame
+  if(report_received == true) {
+    Wire.write(report_confirm);
+    report_received = false;
+    delayMicroseconds(4); // Not waiting causes communication trouble with RPI - sometimes.
+    return;
+  }
+
   // if keyid and action = 0, send device ID (recheck device id during operation)
   if(action == 0b00000000 && keyid == 0b00000000) {
     Wire.write(DEVICE_ID);
@@ -0,0 +1,237 @@
+import json
+import math
+import time
+import logging
+
+
+class AutoTuner:
+    '''
+    Find the fastest reliable link settings of an I2cTransmit object.
+    Every point of a sweep over the bus transport, the pause after key
+    actions (frame gap), the pause after key presses (hold time) and the
+    retry delay runs
+    i2cSpeedtest and measures throughput and error rate. A sweep point is
+    too short to tell a setting at the target error rate from one a few
+    times above it, so the points below the target are confirmed from the
+    fastest on with a long run (see required()) and the first confirmed
+    one is written to a tuning profile, which I2cTransmit loads at
+    startup.
+
+    i2cSpeedtest only runs with the hardware switch off, when the Arduino
+    sends no HID reports. The time the Arduino needs for HID reports with
+    the switch on is not part of the measurement, so the frame gap and
+    hold time found are lower bounds for typing on a target. They are
+    stored under separate keys (I2cTransmit.TIMING), which are only loaded
+    with --profile-timing.
+    '''
+
+    GAPS = [0.0, 0.0002, 0.0005, 0.001, 0.002, 0.005]
+    HOLDS = [0.0, 0.0002, 0.0005, 0.001, 0.002, 0.005]
+    RETRY_DELAYS = [0.001, 0.01, 0.1]
+
+    def __init__(self, keyboard, target_error=0.001,
+                 keyids=range(0, 256, 8)):
+        '''
+        Initialize AutoTuner Object
+
+        Keyword arguments:
+            keyboard -- verified I2cTransmit object, hardware switch off
+            target_error -- maximum accepted ratio of failed attempts
+            keyids -- key ids used by i2cSpeedtest for every point
+        '''
+        self.log = logging.getLogger(__name__)
+        self.keyboard = keyboard
+        self.target_error = target_error
+        self.keyids = keyids
+        self.results = []
+
+    def measure(self, gap, hold, retry_delay, transport=None):
+        '''
+        Run i2cSpeedtest with the given settings
+
+        returns dictionary with settings, "keys_per_s" and "error_rate"
+                or None, if the test could not be run
+        '''
+        if transport is not None and \
+                not self.keyboard.setTransport(transport):
+            return None
+        self.keyboard.retry_delay = retry_delay
+        stats = self.keyboard.i2cSpeedtest(self.keyids, gap, hold)
+        if stats is False:
+            return None
+
+        duration = stats["duration"] / 1000.0
+        result = {
+            "frame_gap": gap,
+            "hold_time": hold,
+            "retry_delay": retry_delay,
+            "transport": self.keyboard.transport,
+            "keys_per_s": stats["count"] / duration if duration > 0 else 0,
+            "error_rate": stats["errors"] / stats["attempts"]
+            if stats["attempts"] > 0 else 1.0,
+            "attempts": stats["attempts"],
+        }
+        self.log.info("measure: %s gap %.4f s hold %.4f s retry delay " +
+                      "%.3f s: %.2f keyactions/s, error rate %.5f " +
+                      "(%d errors in %d attempts)",
+                      result["transport"], gap, hold, retry_delay,
+                      result["keys_per_s"], result["error_rate"],
+                      stats["errors"], stats["attempts"])
+        return result
+
+    def required(self):
+        '''
+        returns number of attempts without a failure that bound the true
+        error rate below target_error at 95% confidence (rule of three)
+        '''
+        return int(math.ceil(3.0 / self.target_error))
+
+    def confirm(self, result):
+        '''
+        Repeat i2cSpeedtest with the settings of a sweep result until
+        required() attempts passed, stop at the first failure
+
+        Keyword arguments:
+            result -- measurement result, "attempts" and "error_rate" are
+                      replaced by the ones of the confirmation run
+        returns True, when the result is confirmed
+        '''
+        required = self.required()
+        saved = self.save()
+        errors = 0
+        attempts = 0
+        try:
+            if not self.keyboard.setTransport(result["transport"]):
+                return False
+            self.keyboard.retry_delay = result["retry_delay"]
+            while errors == 0 and attempts < required:
+                stats = self.keyboard.i2cSpeedtest(self.keyids,
+                                                   result["frame_gap"],
+                                                   result["hold_time"])
+                if stats is False:
+                    return False
+                errors += stats["errors"]
+                attempts += stats["attempts"]
+        finally:
+            self.restore(saved)
+
+        result["attempts"] = attempts
+        result["error_rate"] = errors / attempts if attempts > 0 else 1.0
+        self.log.info("confirm: %s gap %.4f s hold %.4f s retry delay " +
+                      "%.3f s: %d errors in %d attempts, %s",
+                      result["transport"], result["frame_gap"],
+                      result["hold_time"], result["retry_delay"], errors,
+                      attempts, "confirmed" if errors == 0 else "rejected")
+        return errors == 0
+
+    def save(self):
+        '''returns the current settings of the keyboard'''
+        return [getattr(self.keyboard, n) for n in self.keyboard.TUNABLES]
+
+    def restore(self, saved):
+        '''Restore settings returned by save()'''
+        for (n, v) in zip(self.keyboard.TUNABLES, saved):
+            if n == "transport":
+                self.keyboard.setTransport(v)
+            else:
+                setattr(self.keyboard, n, v)
+
+    def transports(self):
+        '''
+        returns the transports the keyboard bus supports
+        '''
+        saved = self.keyboard.transport
+        available = [t for t in self.keyboard.TRANSPORTS
+                     if self.keyboard.setTransport(t)]
+        self.keyboard.setTransport(saved)
+        return available
+
+    def sweep(self, gaps=GAPS, holds=HOLDS, retry_delays=RETRY_DELAYS,
+              transports=None):
+        '''
+        Measure every combination of the given settings
+
+        Keyword arguments:
+            transports -- transports to measure, None for all supported
+        returns list of measurement results
+        '''
+        if transports is None:
+            transports = self.transports()
+        saved = self.save()
+        self.results = []
+        try:
+            for transport in transports:
+                for retry_delay in retry_delays:
+                    for hold in holds:
+                        for gap in gaps:
+                            result = self.measure(gap, hold, retry_delay,
+                                                  transport)
+                            if result is None:
+                                return self.results
+                            self.results.append(result)
+        finally:
+            self.restore(saved)
+        return self.results
+
+    def candidates(self):
+        '''
+        returns the sweep results below the target error rate, fastest
+        first
+        '''
+        ok = [r for r in self.results if r["error_rate"] <= self.target_error]
+        return sorted(ok, key=lambda r: -r["keys_per_s"])
+
+    def best(self):
+        '''
+        returns the fastest sweep result, that passes confirm(), or None
+        '''
+        for result in self.candidates():
+            if self.confirm(result):
+                return result
+        return None
+
+    def writeProfile(self, path, result):
+        '''
+        Write a tuning profile for I2cTransmit.loadProfile
+
+        Keyword arguments:
+            path -- file to write
+            result -- measurement result to store
+        '''
+        profile = {
+            self.keyboard.TIMING["frame_gap"]: result["frame_gap"],
+            self.keyboard.TIMING["hold_time"]: result["hold_time"],
+            "retries": self.keyboard.retries,
+            "retry_delay": result["retry_delay"],
+            "transport": result["transport"],
+            "keys_per_s": result["keys_per_s"],
+            "error_rate": result["error_rate"],
+            "attempts": result["attempts"],
+            "target_error": self.target_error,
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(profile, f, indent=4)
+            f.write("\n")
+        self.log.info("writeProfile: wrote tuning profile " + path)
+
+    def run(self, path):
+        '''
+        Sweep, pick the best setting and write it to path
+
+        returns the chosen result or None
+        '''
+        self.sweep()
+        result = self.best()
+        if result is None:
+            self.log.error("run: no setting reached the target error rate " +
+                           "of %.5f!", self.target_error)
+            return None
+        self.log.info("run: best setting: %s gap %.4f s hold %.4f s retry " +
+                      "delay %.3f s with %.2f keyactions/s at error rate " +
+                      "%.5f in %d attempts", result["transport"],
+                      result["frame_gap"], result["hold_time"],
+                      result["retry_delay"], result["keys_per_s"],
+                      result["error_rate"], result["attempts"])
+        self.writeProfile(path, result)
+        return result
@@ -0,0 +1,243 @@
+import sys
+import time
+import struct
+import argparse
+import logging
+
+MAGIC = b"I2CTRC01"
+
+# record: timestamp, keyid, action, confirm, flags, phase latencies in us
+RECORD = struct.Struct("<dBBBBfff")
+
+FLAG_OK = 0b00000001            # confirmation checks passed
+FLAG_FAIL_KEYID = 0b00000010    # writing KEY-ID failed
+FLAG_FAIL_ACTION = 0b00000100   # writing ACTION (or report frame) failed
+FLAG_FAIL_CONFIRM = 0b00001000  # reading CONFIRM failed
+FLAG_REPORT = 0b00010000        # report frame instead of KEY-ID/ACTION
+FLAG_RDWR = 0b00100000          # one combined I2C_RDWR transaction, its
+                                # duration and failures are on one phase
+
+FLAG_FAIL = FLAG_FAIL_KEYID | FLAG_FAIL_ACTION | FLAG_FAIL_CONFIRM
+
+
+class TraceWriter:
+    '''
+    Append one fixed width binary record per bus transaction to a trace
+    file. Records are RECORD.size bytes after the MAGIC header, so the
+    file can be memory mapped by analyze().
+    '''
+
+    def __init__(self, path):
+        '''
+        Initialize TraceWriter Object
+
+        Keyword arguments:
+            path -- trace file, appended to if it exists
+        '''
+        self.log = logging.getLogger(__name__)
+        self.path = path
+        self.file = open(path, "ab", buffering=1 << 20)
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        self.pack = RECORD.pack
+        self.count = 0
+
+    def record(self, timestamp, keyid, action, confirm, flags, marks):
+        '''
+        Write one transaction record
+
+        Keyword arguments:
+            timestamp -- time.time() at the start of the transaction
+            keyid -- transmitted KEY-ID
+            action -- transmitted ACTION byte
+            confirm -- received CONFIRM byte (0 if not read)
+            flags -- FLAG_* bits
+            marks -- time.perf_counter() before the first and after each
+                     completed phase
+        '''
+        phases = [0.0, 0.0, 0.0]
+        for n in range(1, len(marks)):
+            phases[n - 1] = (marks[n] - marks[n - 1]) * 1e6
+        self.file.write(self.pack(timestamp, keyid & 0xFF, action & 0xFF,
+                                  confirm & 0xFF, flags,
+                                  phases[0], phases[1], phases[2]))
+        self.count += 1
+
+    def close(self):
+        '''Flush and close the trace file'''
+        if not self.file.closed:
+            self.file.close()
+            self.log.info("close: wrote " + str(self.count) +
+                          " records to " + self.path)
+
+
+def load(path):
+    '''
+    Memory map a trace file
+
+    returns numpy structured array of the records
+    '''
+    import numpy as np
+
+    dtype = np.dtype([("ts", "<f8"), ("keyid", "u1"), ("action", "u1"),
+                      ("confirm", "u1"), ("flags", "u1"),
+                      ("t_keyid", "<f4"), ("t_action", "<f4"),
+                      ("t_confirm", "<f4")])
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(path + " is not an i2ckeyboard trace file")
+        f.seek(0, 2)
+        size = f.tell()
+    count = (size - len(MAGIC)) // dtype.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=len(MAGIC),
+                     shape=(count,))
+
+
+def analyze(path, window=60.0, chunk=1 << 22):
+    '''
+    Compute error and latency statistics of a trace file in bulk. The file
+    is memory mapped and processed in chunks of records, so the memory use
+    does not depend on the length of the trace.
+
+    Keyword arguments:
+        path -- trace file written by TraceWriter
+        window -- length of the latency percentile windows in seconds
+        chunk -- number of records processed at once
+    returns dictionary with the statistics
+    '''
+    import numpy as np
+
+    data = load(path)
+    popcount = np.array([bin(i).count("1") for i in range(256)],
+                        dtype=np.uint8)
+
+    total = np.zeros(256, dtype=np.int64)
+    failed = np.zeros(256, dtype=np.int64)
+    bits = np.zeros(8, dtype=np.int64)
+    runs = {}           # length of consecutive failure runs -> count
+    run = 0             # failure run carried over chunk boundaries
+
+    for start in range(0, len(data), chunk):
+        part = data[start:start + chunk]
+        keyid = part["keyid"]
+        err = (part["flags"] & FLAG_OK) == 0
+
+        total += np.bincount(keyid, minlength=256)
+        failed += np.bincount(keyid[err], minlength=256)
+
+        # compare confirm with the one expected for the sent bytes; LED and
+        # switch status can not be known and are taken from the answer
+        read = ((part["flags"] & (FLAG_FAIL | FLAG_REPORT)) == 0)
+        confirm = part["confirm"][read]
+        expected = ((popcount[keyid[read]].astype(np.uint16) +
+                     popcount[part["action"][read]]) & 0b00001111)
+        expected = expected.astype(np.uint8) | (confirm & 0b00110000)
+        expected |= np.where(popcount[expected] % 2 == 0,
+                             0b10000000, 0).astype(np.uint8)
+        diff = confirm ^ expected
+        bits += np.unpackbits(diff[:, None], axis=1).sum(
+            axis=0, dtype=np.int64)[::-1]
+
+        # lengths of runs of consecutive failures (retry clusters)
+        edges = np.diff(np.concatenate(([0], err.astype(np.int8), [0])))
+        begins = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+        lengths = ends - begins
+        if len(lengths) and begins[0] == 0 and run:
+            lengths[0] += run
+        elif run:
+            runs[run] = runs.get(run, 0) + 1
+        run = 0
+        if len(lengths) and ends[-1] == len(err):
+            run = int(lengths[-1])
+            lengths = lengths[:-1]
+        for (length, n) in zip(*np.unique(lengths, return_counts=True)):
+            runs[int(length)] = runs.get(int(length), 0) + int(n)
+    if run:
+        runs[run] = runs.get(run, 0) + 1
+
+    # latency percentiles per time window, records are in time order
+    windows = []
+    if len(data):
+        ts = data["ts"]
+        first = float(ts[0])
+        begin = 0
+        edge = first + window
+        while begin < len(data):
+            end = int(np.searchsorted(ts, edge, side="left"))
+            if end > begin:
+                part = data[begin:end]
+                ok = (part["flags"] & FLAG_FAIL) == 0
+                lat = (part["t_keyid"][ok].astype(np.float64) +
+                       part["t_action"][ok] + part["t_confirm"][ok])
+                if len(lat):
+                    p = np.percentile(lat, [50, 90, 99, 100])
+                    windows.append((edge - window, end - begin,
+                                    p[0], p[1], p[2], p[3]))
+            begin = end
+            edge += window
+            if begin < len(data) and ts[begin] >= edge:
+                # skip empty windows
+                edge = first + (np.floor((ts[begin] - first) / window) +
+                                1) * window
+
+    used = np.flatnonzero(total)
+    return {
+        "records": len(data),
+        "errors": int(failed.sum()),
+        "error_rate": float(failed.sum()) / len(data) if len(data) else 0,
+        "keyid_error_rate": [(int(k), int(total[k]), int(failed[k]),
+                              float(failed[k]) / total[k]) for k in used],
+        "bit_errors": [int(b) for b in bits],
+        "retry_clusters": sorted(runs.items()),
+        "latency_windows": windows,
+    }
+
+
+def report(result, log, top=10):
+    '''Write the analyze() result to the log'''
+    log.info("%d records, %d errors (error rate %.6f)", result["records"],
+             result["errors"], result["error_rate"])
+
+    worst = sorted(result["keyid_error_rate"], key=lambda r: -r[3])[:top]
+    for (keyid, n, f, rate) in worst:
+        if f:
+            log.info("keyid %3d: %d of %d failed (%.6f)", keyid, f, n, rate)
+
+    log.info("confirm bit errors (bit 0 ... 7): " +
+             " ".join(str(b) for b in result["bit_errors"]))
+
+    clusters = result["retry_clusters"]
+    if clusters:
+        log.info("failure runs (length x count): " +
+                 ", ".join("%dx%d" % c for c in clusters))
+
+    for (begin, n, p50, p90, p99, pmax) in result["latency_windows"]:
+        log.info("window %s: %d transactions, latency p50 %.1f us " +
+                 "p90 %.1f us p99 %.1f us max %.1f us",
+                 time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(begin)),
+                 n, p50, p90, p99, pmax)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="analyze i2ckeyboard " +
+                                     "bus traces")
+    parser.add_argument("trace",
+                        help="trace file written with --trace",
+                        type=str)
+    parser.add_argument("--window",
+                        help="latency percentile window in seconds",
+                        type=float,
+                        default=60.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    log = logging.getLogger("bustrace")
+    try:
+        result = analyze(args.trace, args.window)
+    except ImportError:
+        log.error("numpy is required to analyze traces!")
+        sys.exit(1)
+    report(result, log)
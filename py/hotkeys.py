@@ -0,0 +1,281 @@
+import json
+import logging
+
+from keyevents import KEY_EVENTS
+
+
+class Hotkey:
+    '''
+    One compiled binding of a chord or sequence to a local action
+    '''
+
+    def __init__(self, name, keys, sequence, action, argument, swallow):
+        '''
+        Initialize Hotkey Object
+
+        Keyword arguments:
+            name -- name used in log messages
+            keys -- key codes of the chord or sequence
+            sequence -- True for a sequence, False for a chord
+            action -- one of HotkeyEngine.ACTIONS
+            argument -- target address or macro text
+            swallow -- never forward the keys of the hotkey
+        '''
+        self.name = name
+        self.keys = keys
+        self.sequence = sequence
+        self.action = action
+        self.argument = argument
+        self.swallow = swallow
+        self.mask = 0
+        for code in keys:
+            self.mask |= 1 << code
+
+
+class HotkeyEngine:
+    '''
+    Match key events against configured hotkeys before they are forwarded.
+
+    Chords are sets of keys held down together, in any order. The held
+    keys are kept as a bitmask of key codes, so a chord lookup is one dict
+    access with the mask as key. Sequences are consecutive key presses,
+    compiled into a trie that advances one node per press; a press that
+    does not continue a sequence restarts matching at the root. A chord
+    to exit is always bound, even if the configuration does not bind one.
+
+    Key events are passed through the engine before forwarding. Events
+    that may still complete a swallowing hotkey (a part of its chord or a
+    prefix of its sequence) are held back; they are dropped, when the
+    hotkey triggers, and released for forwarding, as soon as the match
+    fails. Swallowing hotkeys therefore delay keys they start with.
+    '''
+
+    EXIT = "exit"        # stop forwarding and exit
+    PAUSE = "pause"      # toggle forwarding of key events
+    TARGET = "target"    # switch to the Arduino at argument "address"
+    MACRO = "macro"      # send argument "text" with sendText
+    ACTIONS = [EXIT, PAUSE, TARGET, MACRO]
+
+    DEFAULT_EXIT = ["KEY_E", "KEY_X", "KEY_I", "KEY_T", "KEY_RIGHTSHIFT",
+                    "KEY_1"]
+
+    def __init__(self, path=None):
+        '''
+        Initialize HotkeyEngine Object
+
+        Keyword arguments:
+            path -- JSON configuration file (None: only the exit chord)
+        '''
+        self.log = logging.getLogger(__name__)
+        self.path = path
+        self.compiled = self.compile({})
+        self.held = 0          # bitmask of held key codes
+        self.node = 0          # current trie node of the sequence match
+        self.pending = []      # held back (code, value, timestamp)
+        self.buffered = 0      # bitmask of keys pressed in self.pending
+        self.dropped = 0       # bitmask of swallowed, still held keys
+        if path is not None:
+            self.load()
+
+    def keyCode(self, name):
+        '''
+        Resolve key name ("KEY_A") or number to key code
+
+        returns key code
+        '''
+        if isinstance(name, int):
+            code = name
+        elif name in KEY_EVENTS:
+            code = KEY_EVENTS[name]
+        else:
+            raise ValueError("unknown key '" + str(name) + "'")
+        if code < 0 or code > 255:
+            raise ValueError("key code " + str(code) + " out of range")
+        return code
+
+    def compile(self, config):
+        '''
+        Compile a configuration into lookup tables
+
+        Keyword arguments:
+            config -- dictionary with "bindings", a list of dictionaries
+                      with "chord" or "sequence" (list of keys), "action",
+                      "address" (target), "text" (macro), "swallow" and
+                      an optional "name"
+        returns (chords, trie, ends, prefixes, holds) with a dict of
+                chord masks to hotkeys, the trie as list of {key code:
+                node} dicts, the hotkey ending at each trie node (or None),
+                the set of partial masks of swallowing chords and for each
+                trie node, whether a swallowing sequence continues there
+        '''
+        bindings = list(config.get("bindings", []))
+        if not any(b.get("action") == self.EXIT for b in bindings):
+            bindings.append({"name": "exit", "chord": self.DEFAULT_EXIT,
+                             "action": self.EXIT})
+
+        chords = {}
+        trie = [{}]
+        ends = [None]
+        for binding in bindings:
+            action = binding.get("action")
+            if action not in self.ACTIONS:
+                raise ValueError("unknown action '" + str(action) + "'")
+            argument = None
+            if action == self.TARGET:
+                argument = int(binding["address"])
+            elif action == self.MACRO:
+                argument = str(binding["text"])
+
+            sequence = "sequence" in binding
+            keys = [self.keyCode(k) for k in
+                    binding["sequence" if sequence else "chord"]]
+            if not keys:
+                raise ValueError("hotkey without keys")
+            name = binding.get("name", " ".join(
+                str(k) for k in binding["sequence" if sequence
+                                        else "chord"]))
+            hotkey = Hotkey(name, keys, sequence, action, argument,
+                            bool(binding.get("swallow", False)))
+
+            if not sequence:
+                if hotkey.mask in chords:
+                    raise ValueError("chord '" + name + "' bound twice")
+                chords[hotkey.mask] = hotkey
+                continue
+
+            node = 0
+            for code in keys:
+                if ends[node] is not None:
+                    raise ValueError("sequence '" + name + "' continues " +
+                                     "sequence '" + ends[node].name + "'")
+                if code not in trie[node]:
+                    trie[node][code] = len(trie)
+                    trie.append({})
+                    ends.append(None)
+                node = trie[node][code]
+            if ends[node] is not None or trie[node]:
+                raise ValueError("sequence '" + name + "' is bound twice " +
+                                 "or starts another sequence")
+            ends[node] = hotkey
+
+        prefixes = set()
+        for hotkey in chords.values():
+            if hotkey.swallow:
+                keys = [1 << code for code in set(hotkey.keys)]
+                for n in range(1, (1 << len(keys)) - 1):
+                    mask = 0
+                    for (i, bit) in enumerate(keys):
+                        if n & (1 << i):
+                            mask |= bit
+                    prefixes.add(mask)
+
+        # children are created after their parents
+        holds = [False] * len(trie)
+        for node in range(len(trie) - 1, 0, -1):
+            holds[node] = any(holds[n] or (ends[n] is not None and
+                                           ends[n].swallow)
+                              for n in trie[node].values())
+
+        return (chords, trie, ends, prefixes, holds)
+
+    def load(self):
+        '''
+        Load and compile the configuration file and activate it.
+        On errors the previous configuration stays active.
+
+        returns True, when the configuration has been activated
+        '''
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                compiled = self.compile(json.load(f))
+        except (OSError, ValueError, KeyError, TypeError,
+                AttributeError) as e:
+            self.log.error("load: failed to load hotkey configuration " +
+                           str(self.path) + ": " + str(e))
+            return False
+
+        self.compiled = compiled
+        self.node = 0
+        self.log.info("load: activated hotkey configuration " +
+                      str(self.path) + " with " +
+                      str(len(compiled[0]) + sum(
+                          1 for e in compiled[2] if e is not None)) +
+                      " hotkey(s)")
+        return True
+
+    def hotkeys(self, action=None):
+        '''
+        returns list of the bound hotkeys, optionally only for one action
+        '''
+        (chords, trie, ends, prefixes, holds) = self.compiled
+        found = list(chords.values()) + [e for e in ends if e is not None]
+        return [h for h in found if action is None or h.action == action]
+
+    def holding(self):
+        '''returns True, while a swallowing hotkey may still match'''
+        (chords, trie, ends, prefixes, holds) = self.compiled
+        return self.held in prefixes or holds[self.node]
+
+    def feed(self, code, value, timestamp=None):
+        '''
+        Track one key event and match the hotkeys
+
+        Keyword arguments:
+            code -- key code of the input device
+            value -- 1 for key press, 0 for key release
+            timestamp -- input time of the event, returned with it
+        returns (hotkey, events) with the triggered Hotkey or None and the
+                list of (code, value, timestamp) events to forward now
+        '''
+        bit = 1 << code
+        if value == 0:
+            self.held &= ~bit
+            if self.dropped & bit:
+                self.dropped &= ~bit
+                return (None, [])
+            if not self.buffered & bit:
+                return (None, [(code, value, timestamp)])
+            self.pending.append((code, value, timestamp))
+            if self.holding():
+                return (None, [])
+            return (None, self.flush())
+
+        self.held |= bit
+        (chords, trie, ends, prefixes, holds) = self.compiled
+        hotkey = chords.get(self.held)
+
+        events = []
+        node = trie[self.node].get(code)
+        if node is None:
+            if self.node != 0:
+                # sequence broken, the held back keys are no hotkey
+                events = self.flush()
+            node = trie[0].get(code, 0)
+        if ends[node] is not None:
+            if hotkey is None:
+                hotkey = ends[node]
+            node = 0
+        self.node = node
+
+        self.pending.append((code, value, timestamp))
+        self.buffered |= bit
+        if hotkey is not None and hotkey.swallow:
+            self.dropped |= self.held & self.buffered
+            self.pending = []
+            self.buffered = 0
+            self.node = 0
+            return (hotkey, events)
+        if hotkey is None and self.holding():
+            return (None, events)
+        return (hotkey, events + self.flush())
+
+    def flush(self):
+        '''
+        Stop holding back events
+
+        returns list of the held back (code, value, timestamp) events
+        '''
+        events = self.pending
+        self.pending = []
+        self.buffered = 0
+        return events
@@ -11,37 +11,115 @@ import asyncio
 import logging
 
 import i2ctransmit
-from keymap import KEY_MAP
+import keyreflect
+import latency
+import remap
+import hotkeys
+import scheduler
+import autotune
+import simbus
+import json
+import keymap
+import bustrace
+import atexit
 from keyevents import *
 
 address = 0x10  # I2C/TWI hardwareadress of keyboard
 
 
-async def handleEvents(device):
-    '''Key event handler'''
+async def handleEvents(device, lowlatency=False, remapper=None,
+                       transmit=None, hotkeys=None):
+    '''
+    Key event handler
+
+    Keyword arguments:
+        device -- evdev input device to read key events from
+        lowlatency -- carry the event timestamp to the confirm read and
+                      leave flushing stdin to flushInput()
+        remapper -- RemapEngine translating key codes before forwarding
+        transmit -- TransmitScheduler to queue key events with
+                    (default: transmit directly with keyboard)
+        hotkeys -- HotkeyEngine matching the input key codes
+    '''
+    if transmit is None:
+        transmit = keyboard
+    keyAction = transmit.keyAction
+    KEY_PRESS = keyboard.KEY_PRESS
+    KEY_RELEASE = keyboard.KEY_RELEASE
+    LED_ON = keyboard.LED_ON
+    debug = log.isEnabledFor(logging.DEBUG)
+    down = {}        # input key code -> forwarded key code of pressed keys
+    paused = False   # forwarding paused by hotkey
     async for event in device.async_read_loop():
         if event.type == 1 and event.value < 2:
-            move = event.value
-            if event.value == 1:
-                move = "key down  "
-                keyboard.keyAction(event.code,
-                                   keyboard.KEY_PRESS,
-                                   keyboard.LED_ON)
-            if event.value == 0:
-                move = "key up    "
-                keyboard.keyAction(event.code,
-                                   keyboard.KEY_RELEASE,
-                                   keyboard.LED_ON)
-            log.debug(move +
-                      str(event.code) + " - " +
-                      str(evdev.ecodes.KEY[event.code]))
-            if keyboard.pressedKeys() == [KEY_E, KEY_X, KEY_I, KEY_T,
-                                          KEY_RIGHTSHIFT, KEY_1]:
-                log.info("'exit!' detected, exiting")
-                loop.stop()
-                keyboard.releaseAll()
+            timestamp = event.timestamp() if lowlatency else None
+            hotkey = None
+            events = [(event.code, event.value, timestamp)]
+            if hotkeys is not None:
+                (hotkey, events) = hotkeys.feed(event.code, event.value,
+                                                timestamp)
+            for (key, value, timestamp) in events:
+                code = key
+                if remapper is not None:
+                    code = remapper.map(key, value)
+                if code < 0:
+                    pass
+                elif value == 1:
+                    if not paused:
+                        keyAction(code, KEY_PRESS, LED_ON, timestamp)
+                        down[key] = code
+                elif down.pop(key, None) is not None:
+                    keyAction(code, KEY_RELEASE, LED_ON, timestamp)
+                if debug:
+                    move = "key down  " if value == 1 else "key up    "
+                    log.debug(move +
+                              str(key) + " - " +
+                              str(evdev.ecodes.KEY[key]) +
+                              " -> " + str(code))
 
-            tcflush(sys.stdin, TCIOFLUSH)
+            if hotkey is not None:
+                log.info("hotkey '" + hotkey.name + "' detected: " +
+                         hotkey.action)
+                if hotkey.swallow:
+                    # release keys of the hotkey forwarded before it could
+                    # be recognized (e.g. pressed before a broken sequence)
+                    for key in hotkey.keys:
+                        forwarded = down.pop(key, None)
+                        if forwarded is not None:
+                            keyAction(forwarded, KEY_RELEASE, LED_ON)
+                if hotkey.action == hotkeys.EXIT:
+                    log.info("'exit!' detected, exiting")
+                    loop.stop()
+                    transmit.releaseAll()
+                elif hotkey.action == hotkeys.PAUSE:
+                    paused = not paused
+                    if paused:
+                        transmit.releaseAll()
+                        down = {}
+                    log.info("Forwarding " +
+                             ("paused" if paused else "resumed"))
+                elif hotkey.action == hotkeys.TARGET:
+                    transmit.setAddress(hotkey.argument)
+                    down = {}
+                elif hotkey.action == hotkeys.MACRO:
+                    transmit.sendText(hotkey.argument)
+
+            if not lowlatency:
+                tcflush(sys.stdin, TCIOFLUSH)
+
+
+def flushInput(interval):
+    '''
+    Periodically discard local terminal input and check the latency SLO
+    instead of doing so after every event
+
+    Keyword arguments:
+        interval -- seconds between two calls
+    '''
+    tcflush(sys.stdin, TCIOFLUSH)
+    if keyboard.latency is not None:
+        keyboard.latency.checkSlo()
+    loop.call_later(interval, flushInput, interval)
 
 
 def createParser():
@@ -54,13 +132,92 @@ def createParser():
                         type=str,
                         default="INFO",
                         action="store")
+    parser.add_argument("--layout",
+                        help="keyboard layout of the target machine",
+                        choices=keymap.layouts(),
+                        type=str,
+                        default=keymap.DEFAULT_LAYOUT,
+                        action="store")
+    parser.add_argument("--report",
+                        help="transmit the complete key state as one HID " +
+                             "report per change instead of single key events",
+                        action="store_true")
     parser.add_argument("--speedtest",
                         help="run key command transmission speed test",
                         action="store_true")
+    parser.add_argument("--autotune",
+                        help="sweep link settings with the speed test and " +
+                             "write the fastest reliable ones to --profile",
+                        action="store_true")
+    parser.add_argument("--target-error",
+                        help="maximum error rate accepted by --autotune",
+                        type=float,
+                        default=0.001,
+                        action="store")
+    parser.add_argument("--profile",
+                        help="tuning profile to load and to write with " +
+                             "--autotune",
+                        type=str,
+                        default=i2ctransmit.I2cTransmit.TUNING_PROFILE,
+                        action="store")
+    parser.add_argument("--profile-timing",
+                        help="also use frame gap and hold time of the " +
+                             "tuning profile for sending text (measured " +
+                             "with the hardware switch off, unverified)",
+                        action="store_true")
+    parser.add_argument("--simulate",
+                        help="use a simulated Arduino instead of the i2c " +
+                             "bus, optionally configured with a JSON " +
+                             "object of SimBus arguments",
+                        nargs="?",
+                        const="{}",
+                        default=None,
+                        type=str,
+                        action="store")
+    parser.add_argument("--transport",
+                        help="bus access per key event: 'smbus' (three " +
+                             "transactions) or 'rdwr' (one combined " +
+                             "transaction, needs smbus2); default: " +
+                             "tuning profile or 'smbus'",
+                        choices=i2ctransmit.I2cTransmit.TRANSPORTS,
+                        default=None,
+                        action="store")
+    parser.add_argument("--trace",
+                        help="record every bus transaction to a binary " +
+                             "trace file (analyze with bustrace.py)",
+                        type=str,
+                        default=None,
+                        action="store")
     parser.add_argument("--keyboard",
                         help="read keyboard keys and transmit for " +
                              "sending to arduino",
                         action="store_true")
+    parser.add_argument("--lowlatency",
+                        help="forward keys in low latency mode and track " +
+                             "input to confirm latency (with --keyboard)",
+                        action="store_true")
+    parser.add_argument("--slo-p99",
+                        help="p99 latency alarm threshold in ms for " +
+                             "--lowlatency",
+                        type=float,
+                        default=20.0,
+                        action="store")
+    parser.add_argument("--schedule",
+                        help="queue key events and text through a priority " +
+                             "scheduler, live keys preempt text injection",
+                        action="store_true")
+    parser.add_argument("--remap",
+                        help="JSON key remap configuration for --keyboard," +
+                             " reloaded on change",
+                        type=str,
+                        default=None,
+                        action="store")
+    parser.add_argument("--hotkeys",
+                        help="JSON hotkey configuration for --keyboard " +
+                             "(exit, pause, target and macro actions)",
+                        type=str,
+                        default=None,
+                        action="store")
     parser.add_argument("--sendtext",
                         help="Send sample characters for testing",
                         action="store_true")
@@ -68,6 +225,30 @@ def createParser():
                         help="Plug Arduino keyboard into pi and test if keys" +
                              " are send correctly!",
                         action="store_true")
+    parser.add_argument("--streamreflect",
+                        help="Plug Arduino keyboard into pi and stream a " +
+                             "corpus through the loopback to measure " +
+                             "sustained throughput and error rate",
+                        action="store_true")
+    parser.add_argument("--corpus",
+                        help="text file to stream with --streamreflect " +
+                             "(default: test characters)",
+                        type=str,
+                        default=None,
+                        action="store")
+    parser.add_argument("--reflectdevice",
+                        help="evdev device (path or name) of the looped " +
+                             "back Arduino to read with --streamreflect " +
+                             "instead of stdin",
+                        type=str,
+                        default=None,
+                        action="store")
+    parser.add_argument("--repeat",
+                        help="number of times the --streamreflect corpus " +
+                             "is sent",
+                        type=int,
+                        default=1,
+                        action="store")
     return parser
 
 
@@ -121,11 +302,25 @@ if __name__ == '__main__':
             level=loglevel)
     log = logging.getLogger(__name__)
 
-    keyboard = i2ctransmit.I2cTransmit(address)
+    bus = None
+    if args.simulate is not None:
+        bus = simbus.SimBus(**json.loads(args.simulate))
+        log.warning("Using simulated Arduino " + args.simulate + "!")
+
+    keyboard = i2ctransmit.I2cTransmit(address, args.layout, args.report,
+                                       bus, args.profile, args.transport,
+                                       args.profile_timing)
+
+    if args.trace is not None:
+        keyboard.trace = bustrace.TraceWriter(args.trace)
+        atexit.register(keyboard.trace.close)
 
     if args.speedtest:
         keyboard.i2cSpeedtest()
 
+    if args.autotune:
+        autotune.AutoTuner(keyboard, args.target_error).run(args.profile)
+
     if args.keyboard:
 
         if not keyboard.keyboardEnabled():
@@ -143,10 +338,30 @@ if __name__ == '__main__':
 
         log.info("Selected device " + str(dev.fn) + " for key event capture!")
         log.warning("Ctrl-C disabled!")
-        log.warning("Press and HOLD 'e' 'x' 'i' 't' 'RightShift' 1' to exit!")
+        hotkeyengine = hotkeys.HotkeyEngine(args.hotkeys)
+        for hotkey in hotkeyengine.hotkeys(hotkeyengine.EXIT):
+            log.warning("Press " + ("" if hotkey.sequence else "and HOLD ") +
+                        " ".join(evdev.ecodes.KEY[k] for k in hotkey.keys) +
+                        " to exit!")
+
+        if args.lowlatency:
+            keyboard.latency = latency.LatencyTracker(args.slo_p99 / 1000)
+
+        remapper = None
+        if args.remap is not None:
+            remapper = remap.RemapEngine(args.remap)
+            asyncio.ensure_future(remapper.watch())
 
-        asyncio.ensure_future(handleEvents(dev))
+        transmit = None
+        if args.schedule:
+            transmit = scheduler.TransmitScheduler(keyboard)
+            transmit.start()
+
+        asyncio.ensure_future(handleEvents(dev, args.lowlatency, remapper,
+                                           transmit, hotkeyengine))
         loop = asyncio.get_event_loop()
+        if args.lowlatency:
+            loop.call_later(1.0, flushInput, 1.0)
         sigint_detect = True
         while sigint_detect:
             sigint_detect = False
@@ -156,6 +371,15 @@ if __name__ == '__main__':
                 sigint_detect = True
             tcflush(sys.stdin, TCIOFLUSH)
 
+        if transmit is not None:
+            transmit.stop(5.0)
+            for line in transmit.summary():
+                log.info(line)
+
+        if keyboard.latency is not None:
+            log.info("Input to confirm latency: " +
+                     keyboard.latency.total.summary())
+
     if args.sendtext:
 
         if not keyboard.keyboardEnabled():
@@ -202,3 +426,32 @@ if __name__ == '__main__':
             log.info("Key speed achieved: " +
                      "%.2f" % (1/((stop - start)/s/1000)) +
                      " keys/s")
+
+    if args.streamreflect:
+
+        if not keyboard.keyboardEnabled():
+            log.warning("Keyboard is not set to sending keys!" +
+                        "Enable hardware switch for testing!")
+            exit(0)
+
+        if args.corpus is not None:
+            with open(args.corpus, encoding="utf-8") as f:
+                corpus = f.read()
+        else:
+            corpus = "".join(testchars)
+
+        reflectdev = None
+        if args.reflectdevice is not None:
+            for fn in evdev.list_devices():
+                device = evdev.InputDevice(fn)
+                if args.reflectdevice in (device.fn, device.name):
+                    reflectdev = device
+            if reflectdev is None:
+                log.error("Device " + args.reflectdevice + " not found!")
+                exit(1)
+            log.info("Reading loopback from " + str(reflectdev.fn) + " " +
+                     str(reflectdev.name))
+
+        verifier = keyreflect.StreamVerifier(keyboard, device=reflectdev)
+        result = verifier.run(corpus * args.repeat)
+        verifier.logReport(result)
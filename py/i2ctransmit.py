@@ -1,8 +1,15 @@
-import smbus
+import os
+import json
+try:
+    import smbus2
+except ImportError:
+    smbus2 = None
 import time
 import logging
 
-from keymap import KEY_MAP
+import keymap
+import bustrace
+from keyevents import KEY_RELEASEALL, HID_USAGE, HID_MODIFIER
 
 
 class I2cTransmit:
@@ -22,20 +29,161 @@ class I2cTransmit:
 
     DEVICE_ID = 0b10000010
 
-    def __init__(self, address):
+    REPORT = 0b11111111
+
+    # bus access: separate smbus byte transactions or one combined
+    # I2C_RDWR transaction (write, repeated start, read) per key event
+    TRANSPORT_SMBUS = "smbus"
+    TRANSPORT_RDWR = "rdwr"
+    TRANSPORTS = [TRANSPORT_SMBUS, TRANSPORT_RDWR]
+
+    # settings a tuning profile may set (see autotune.py)
+    TUNABLES = ["frame_gap", "hold_time", "retries", "retry_delay",
+                "transport"]
+    # pauses measured with the hardware switch off (without HID reports),
+    # stored under these profile keys and only loaded on request
+    TIMING = {"frame_gap": "measured_frame_gap",
+              "hold_time": "measured_hold_time"}
+    TUNING_PROFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  "tuning.json")
+
+    def __init__(self, address, layout=keymap.DEFAULT_LAYOUT,
+                 report_mode=False, bus=None, profile=TUNING_PROFILE,
+                 transport=None, profile_timing=False):
         '''
         Initialize i2ctransmit Object
 
         Keyword arguments:
             address -- address of Arduino Micro on I2C/TWI bus
+            layout -- keyboard layout of the target used by sendText
+            report_mode -- transmit press and release events as complete
+                           HID reports (one block write per state change)
+            bus -- bus object to use instead of smbus.SMBus(1)
+                   (e.g. simbus.SimBus)
+            profile -- tuning profile loaded, if the file exists
+            transport -- TRANSPORT_SMBUS or TRANSPORT_RDWR (needs smbus2),
+                         None to use the profile setting or smbus
+            profile_timing -- also load frame gap and hold time from the
+                              profile (not verified with HID reports)
         '''
+        self.log = logging.getLogger(__name__)
         self.pressed_keys = []        # List of currently pressed keys
         self.address = address        # i2c/TWI hardware address of keyboard
-        self.bus = smbus.SMBus(1)     # use '0' on first gen raspberry pi's
-        self.log = logging.getLogger(__name__)
+        if bus is None:
+            # use '0' on first gen raspberry pi's
+            if transport != self.TRANSPORT_SMBUS and smbus2 is not None:
+                bus = smbus2.SMBus(1)
+            else:
+                import smbus          # only needed for the real i2c bus
+                bus = smbus.SMBus(1)
+        self.bus = bus
+        self.transport = self.TRANSPORT_SMBUS
+        self.i2c_msg = None           # message class for combined transfers
         self.is_keyboard = False      # True if keyboard is verified
+        self.latency = None           # LatencyTracker for timestamped events
+        self.trace = None             # bustrace.TraceWriter for transactions
+        self.layout = keymap.loadLayout(layout)  # target keyboard layout
+        self.report_mode = report_mode  # send key state as HID reports
+        self.report = None            # last report confirmed by Arduino
+        self.report_confirm = None    # confirmation byte of self.report
+        self.frame_gap = 0.001        # sendText pause after releasing keys
+        self.hold_time = 0.001        # sendText pause after pressing keys
+        self.retries = 10             # attempts per key action
+        self.retry_delay = 0.1        # pause after a failed attempt
+        if profile is not None and os.path.exists(profile):
+            self.loadProfile(profile, profile_timing)
+        if transport is not None:
+            self.setTransport(transport)
         self.checkKeyboard()          # try to verify keyboard @ address
 
+    def loadProfile(self, path, timing=False):
+        '''
+        Load link settings from a tuning profile written by autotune.py
+
+        Keyword arguments:
+            path -- JSON tuning profile
+            timing -- also load frame gap and hold time (see TIMING)
+        returns True, when the profile has been loaded
+        '''
+        try:
+            with open(path, encoding="utf-8") as f:
+                profile = json.load(f)
+        except (OSError, ValueError) as e:
+            self.log.error("loadProfile: failed to load tuning profile " +
+                           path + ": " + str(e))
+            return False
+
+        for name in self.TUNABLES:
+            key = name
+            if name in self.TIMING:
+                if not timing:
+                    continue
+                key = self.TIMING[name]
+            if key not in profile:
+                continue
+            if name == "transport":
+                self.setTransport(profile[key])
+            else:
+                setattr(self, name, type(getattr(self, name))(profile[key]))
+        if timing and any(k in profile for k in self.TIMING.values()):
+            self.log.warning("loadProfile: frame gap and hold time were " +
+                             "measured with the hardware switch off and " +
+                             "are not verified for typing!")
+        self.log.info("loadProfile: loaded tuning profile " + path + " " +
+                      str({n: getattr(self, n) for n in self.TUNABLES}))
+        return True
+
+    def setTransport(self, transport):
+        '''
+        Select how key events are put on the bus. TRANSPORT_RDWR needs a
+        bus with i2c_rdwr (smbus2.SMBus or simbus.SimBus), otherwise
+        TRANSPORT_SMBUS stays selected.
+
+        Keyword arguments:
+            transport -- TRANSPORT_SMBUS or TRANSPORT_RDWR
+        returns True, when the transport has been selected
+        '''
+        if transport not in self.TRANSPORTS:
+            self.log.error("setTransport: unknown transport " +
+                           str(transport) + "!")
+            return False
+
+        if transport == self.TRANSPORT_RDWR:
+            i2c_msg = getattr(self.bus, "i2c_msg", None)
+            if i2c_msg is None and smbus2 is not None:
+                i2c_msg = smbus2.i2c_msg
+            if i2c_msg is None or not hasattr(self.bus, "i2c_rdwr"):
+                self.log.error("setTransport: combined transfers need " +
+                               "smbus2, using " + self.transport + "!")
+                return False
+            self.i2c_msg = i2c_msg
+
+        self.transport = transport
+        self.log.info("setTransport: using transport " + transport)
+        return True
+
+    def setAddress(self, address):
+        '''
+        Release all keys and switch to the Arduino Micro at another
+        i2c address
+
+        Keyword arguments:
+            address -- address of Arduino Micro on I2C/TWI bus
+        returns True, when the keyboard at address has been verified
+        '''
+        if address == self.address:
+            return self.is_keyboard
+
+        if self.is_keyboard:
+            self.releaseAll()
+        self.log.info("setAddress: switching from address " +
+                      hex(self.address) + " to " + hex(address))
+        self.address = address
+        self.pressed_keys = []
+        self.report = None
+        self.report_confirm = None
+        return self.checkKeyboard()
+
     def checkKeyboard(self):
         '''
         Check if the given i2c address returns self.DEVICE_ID when
@@ -47,7 +195,7 @@ class I2cTransmit:
         retry = 0
         error_OSError = 0
         error_Exception = 0
-        while not ok and retry < 10:
+        while not ok and retry < self.retries:
             try:
                 dev_id = self.readByte()
                 ok = True
@@ -78,7 +226,7 @@ class I2cTransmit:
 
         retry = 0
         ret = False
-        while ret is False and retry < 10:
+        while ret is False and retry < self.retries:
             ret = self.keyAction(0, self.KEY_TEST, self.LED_OFF)
             retry += 1
 
@@ -106,6 +254,31 @@ class I2cTransmit:
         self.bus.write_byte(self.address, data)
         return True
 
+    def writeBlock(self, command, data):
+        '''
+        Write a command byte followed by data bytes in one transaction
+
+        Keyword arguments:
+            command -- first byte to send
+            data -- list of bytes to send
+        '''
+        self.bus.write_i2c_block_data(self.address, command, data)
+        return True
+
+    def transfer(self, data):
+        '''
+        Write bytes to slave on i2c bus and read one byte back in one
+        combined transaction joined by a repeated start (one ioctl)
+
+        Keyword arguments:
+            data -- list of bytes to send
+        returns data byte
+        '''
+        write = self.i2c_msg.write(self.address, data)
+        read = self.i2c_msg.read(self.address, 1)
+        self.bus.i2c_rdwr(write, read)
+        return list(read)[0]
+
     def readByte(self):
         '''
         Read one byte from slave on i2c bus
@@ -144,6 +317,22 @@ class I2cTransmit:
         '''
         return self.keyAction(keyid, self.KEY_PRESS, self.LED_ON)
 
+    def pressKeys(self, keyids):
+        '''
+        Press all keys in keyids, in report mode with a single report
+        '''
+        if self.report_mode:
+            keys = [k for k in self.pressed_keys if k not in keyids]
+            if KEY_RELEASEALL in keyids:
+                keys = []
+            return self.sendReport(keys + [k for k in keyids
+                                           if k != KEY_RELEASEALL],
+                                   self.LED_ON)
+        ret = False
+        for keyid in keyids:
+            ret = self.press(keyid)
+        return ret
+
     def release(self, keyid):
         '''
         Release key with given keyid
@@ -161,7 +350,7 @@ class I2cTransmit:
 
         retry = 0
         ret = False
-        while ret is False and retry < 10:
+        while ret is False and retry < self.retries:
             ret = self.keyAction(0, self.KEY_RELEASEALL, self.LED_ON)
             retry += 1
         if ret is False:
@@ -179,22 +368,32 @@ class I2cTransmit:
 
         retry = 0
         ret = False
-        while ret is False and retry < 10:
+        while ret is False and retry < self.retries:
             ret = self.keyAction(0, self.KEY_TEST, self.LED_OFF)
             retry += 1
         if ret is False:
             return False
         return self.switch
 
-    def checkConfirm(self, keyid, action, confirm):
+    def checkConfirm(self, keyid, action, confirm, checksum=None):
         '''
         Perform confirmation checks on reveiced confirmation byte
+
+        Keyword arguments:
+            keyid -- transmitted key id (or REPORT)
+            action -- transmitted action (or report CHECK byte)
+            confirm -- received confirmation byte
+            checksum -- expected checksum bits of confirm
+                        (default: sum of bits of keyid and action)
         returns True, when all checks performed as expected
         '''
         message = ""
         ok = True
 
-        if self.bitSum(keyid) + self.bitSum(action) != confirm & 0b00001111:
+        if checksum is None:
+            checksum = self.bitSum(keyid) + self.bitSum(action)
+
+        if checksum != confirm & 0b00001111:
             ok = False
             message = message + " Confirmed checksum failes!"
 
@@ -228,7 +427,7 @@ class I2cTransmit:
                              bin(confirm) + " : " + message)
         return ok
 
-    def keyAction(self, keyid, action, led):
+    def keyAction(self, keyid, action, led, timestamp=None, force=False):
         '''
         transmit key event and controll confirmation
 
@@ -236,6 +435,11 @@ class I2cTransmit:
             keyid -- code of key to press
             action -- action to perform (s. variables above)
             led -- led on or of (s. variable above)
+            timestamp -- time.time() based input time of the event; the
+                         input to confirm latency is recorded in
+                         self.latency, when both are set
+            force -- in report mode transfer the report, even if it equals
+                     the last confirmed one
         returns:
             False on transmission error
             (ok, confirm) on transmission success
@@ -245,6 +449,17 @@ class I2cTransmit:
         if not self.is_keyboard:
             return False
 
+        if self.report_mode:
+            if action == self.KEY_PRESS:
+                return self.sendReport(self.pressed_keys + [keyid], led,
+                                       timestamp, force)
+            elif action == self.KEY_RELEASE:
+                return self.sendReport([k for k in self.pressed_keys
+                                        if k != keyid], led, timestamp,
+                                       force)
+            elif action == self.KEY_RELEASEALL:
+                return self.sendReport([], led, timestamp, force)
+
         _action = action
         action = action + led
 
@@ -255,43 +470,91 @@ class I2cTransmit:
         # add checksum (number of bits equal 1)
         action = action + (self.bitSum(keyid) + self.bitSum(action))
 
-        # send key id to Arduino Micro
-        try:
-            self.writeByte(keyid)
-        except IOError as e:
-            self.log.error("keyAction: Error writing 'keyid' " +
-                           bin(keyid) + " to " +
-                           "address " + hex(self.address) + "!")
-            return False
-        except Exception as e:
-            self.log.exception("keyAction: Unexpected error!")
-            return False
+        trace = self.trace
+        if trace is not None:
+            start = time.time()
+            marks = [time.perf_counter()]
+            flags = 0
+            if self.transport == self.TRANSPORT_RDWR:
+                flags = bustrace.FLAG_RDWR
 
-        # send action request to Arduino Micro
-        try:
-            self.writeByte(action)
-        except IOError as e:
-            self.log.error("keyAction: Error writing 'action' " +
-                           bin(action) + " to " +
-                           "address " + hex(self.address) + "!")
-            return False
-        except Exception as e:
-            self.log.exception("keyAction: Unexpected error!")
-            return False
+        if self.transport == self.TRANSPORT_RDWR:
+            # send key id and action, read confirmation in one transaction
+            try:
+                confirm = self.transfer([keyid, action])
+            except IOError as e:
+                self.log.error("keyAction: Error transferring 'keyid' " +
+                               bin(keyid) + " and 'action' " + bin(action) +
+                               " to address " + hex(self.address) + "!")
+                if trace is not None:
+                    trace.record(start, keyid, action, 0,
+                                 flags | bustrace.FLAG_FAIL_CONFIRM, marks)
+                return False
+            except Exception as e:
+                self.log.exception("keyAction: Unexpected error!")
+                return False
+            if trace is not None:
+                marks.append(time.perf_counter())
+        else:
+            # send key id to Arduino Micro
+            try:
+                self.writeByte(keyid)
+            except IOError as e:
+                self.log.error("keyAction: Error writing 'keyid' " +
+                               bin(keyid) + " to " +
+                               "address " + hex(self.address) + "!")
+                if trace is not None:
+                    trace.record(start, keyid, action, 0,
+                                 bustrace.FLAG_FAIL_KEYID, marks)
+                return False
+            except Exception as e:
+                self.log.exception("keyAction: Unexpected error!")
+                return False
+            if trace is not None:
+                marks.append(time.perf_counter())
 
-        # read confirmation response from Arduino Micro
-        try:
-            confirm = self.readByte()
-        except OSError as e:
-            self.log.error("keyAction: Error reading 'confirm' from " +
-                           "address " + hex(self.address) + "!")
-            return False
-        except Exception as e:
-            self.log.exception("keyAction: Unexpected error!")
-            return False
+            # send action request to Arduino Micro
+            try:
+                self.writeByte(action)
+            except IOError as e:
+                self.log.error("keyAction: Error writing 'action' " +
+                               bin(action) + " to " +
+                               "address " + hex(self.address) + "!")
+                if trace is not None:
+                    trace.record(start, keyid, action, 0,
+                                 bustrace.FLAG_FAIL_ACTION, marks)
+                return False
+            except Exception as e:
+                self.log.exception("keyAction: Unexpected error!")
+                return False
+            if trace is not None:
+                marks.append(time.perf_counter())
+
+            # read confirmation response from Arduino Micro
+            try:
+                confirm = self.readByte()
+            except OSError as e:
+                self.log.error("keyAction: Error reading 'confirm' from " +
+                               "address " + hex(self.address) + "!")
+                if trace is not None:
+                    trace.record(start, keyid, action, 0,
+                                 bustrace.FLAG_FAIL_CONFIRM, marks)
+                return False
+            except Exception as e:
+                self.log.exception("keyAction: Unexpected error!")
+                return False
+            if trace is not None:
+                marks.append(time.perf_counter())
+
+        if timestamp is not None and self.latency is not None:
+            self.latency.record(time.time() - timestamp)
 
         ok = self.checkConfirm(keyid, action, confirm)
 
+        if trace is not None:
+            trace.record(start, keyid, action, confirm,
+                         flags | (bustrace.FLAG_OK if ok else 0), marks)
+
         if ok:
             if _action == self.KEY_PRESS:
                 self.pressed_keys.append(keyid)
@@ -304,16 +567,161 @@ class I2cTransmit:
 
         return (ok, confirm)
 
+    def hidReport(self, keys):
+        '''
+        Build the boot keyboard report for the given pressed keys
+
+        Keyword arguments:
+            keys -- list of pressed key ids
+        returns list of modifier byte and six HID usage ids
+        '''
+        modifiers = 0
+        usages = []
+        for keyid in keys:
+            if keyid in HID_MODIFIER:
+                modifiers |= HID_MODIFIER[keyid]
+            elif keyid in HID_USAGE and len(usages) < 6:
+                if HID_USAGE[keyid] not in usages:
+                    usages.append(HID_USAGE[keyid])
+        return [modifiers] + usages + [0] * (6 - len(usages))
+
+    def sendReport(self, keys, led, timestamp=None, force=False):
+        '''
+        Set the complete key state of the Arduino Micro with one block
+        transfer, when it differs from the last confirmed state.
+
+        Keyword arguments:
+            keys -- list of key ids that should be pressed
+                    (KEY_RELEASEALL releases all keys)
+            led -- led on or of
+            timestamp -- time.time() based input time of the event
+            force -- transfer the report, even if it equals the last
+                     confirmed one
+        returns:
+            False on transmission error
+            (ok, confirm) on transmission success
+        '''
+        if not self.is_keyboard:
+            return False
+
+        if KEY_RELEASEALL in keys:
+            keys = []
+        keys = [k for (n, k) in enumerate(keys) if k not in keys[:n]]
+
+        report = self.hidReport(keys)
+        check = sum(self.bitSum(b) for b in report)
+        if led == self.LED_ON:
+            check = check + 0b01000000
+        if self.bitSum(check) % 2 == 0:
+            check = check + 0b10000000
+
+        if report + [check] == self.report and not force:
+            self.pressed_keys = keys
+            return (True, self.report_confirm)
+
+        trace = self.trace
+        if trace is not None:
+            start = time.time()
+            marks = [time.perf_counter()]
+            flags = 0
+            if self.transport == self.TRANSPORT_RDWR:
+                flags = bustrace.FLAG_RDWR
+
+        if self.transport == self.TRANSPORT_RDWR:
+            # send report frame, read confirmation in one transaction
+            try:
+                confirm = self.transfer([self.REPORT] + report + [check])
+            except IOError as e:
+                self.log.error("sendReport: Error transferring report " +
+                               str(report) + " to " +
+                               "address " + hex(self.address) + "!")
+                if trace is not None:
+                    trace.record(start, self.REPORT, check, 0,
+                                 bustrace.FLAG_REPORT | flags |
+                                 bustrace.FLAG_FAIL_CONFIRM, marks)
+                return False
+            except Exception as e:
+                self.log.exception("sendReport: Unexpected error!")
+                return False
+            if trace is not None:
+                marks.append(time.perf_counter())
+        else:
+            # send report frame to Arduino Micro
+            try:
+                self.writeBlock(self.REPORT, report + [check])
+            except IOError as e:
+                self.log.error("sendReport: Error writing report " +
+                               str(report) + " to " +
+                               "address " + hex(self.address) + "!")
+                if trace is not None:
+                    trace.record(start, self.REPORT, check, 0,
+                                 bustrace.FLAG_REPORT |
+                                 bustrace.FLAG_FAIL_ACTION, marks)
+                return False
+            except Exception as e:
+                self.log.exception("sendReport: Unexpected error!")
+                return False
+            if trace is not None:
+                marks.append(time.perf_counter())
+
+            # read confirmation response from Arduino Micro
+            try:
+                confirm = self.readByte()
+            except OSError as e:
+                self.log.error("sendReport: Error reading 'confirm' from " +
+                               "address " + hex(self.address) + "!")
+                if trace is not None:
+                    trace.record(start, self.REPORT, check, 0,
+                                 bustrace.FLAG_REPORT |
+                                 bustrace.FLAG_FAIL_CONFIRM, marks)
+                return False
+            except Exception as e:
+                self.log.exception("sendReport: Unexpected error!")
+                return False
+            if trace is not None:
+                marks.append(time.perf_counter())
+
+        if timestamp is not None and self.latency is not None:
+            self.latency.record(time.time() - timestamp)
+
+        checksum = (check & 0b00111111) + self.bitSum(check)
+        ok = self.checkConfirm(self.REPORT, check, confirm,
+                               checksum & 0b00001111)
+
+        if trace is not None:
+            trace.record(start, self.REPORT, check, confirm,
+                         bustrace.FLAG_REPORT | flags |
+                         (bustrace.FLAG_OK if ok else 0), marks)
+
+        if ok:
+            self.report = report + [check]
+            self.report_confirm = confirm
+            self.pressed_keys = keys
+            self.log.debug("Pressed keys: " + str(self.pressed_keys))
+        else:
+            self.report = None
+
+        return (ok, confirm)
+
     def _now(self):
         '''Return current time in Microseconds'''
         return int(round(time.time() * 1000))
 
-    def i2cSpeedtest(self):
+    def i2cSpeedtest(self, keyids=range(0, 256), gap=0.0, hold=0.0):
         '''
         Perform speedtest to test key press transmission on i2c bus
         Disabled hardware key is enforced. This test is running all
         possible keyids in numeric order and would cause unforseeable
         effects, if these would become key events on any machine!
+
+        Keyword arguments:
+            keyids -- key ids to test
+            gap -- pause after each key action in seconds
+            hold -- pause after each key press in seconds
+        returns False, if the test could not be run, otherwise dictionary
+                with the number of successfull transmissions ("count"),
+                failed attempts ("errors"), all attempts ("attempts"),
+                the test duration in ms ("duration") and the transport
         '''
 
         if not self.is_keyboard:
@@ -327,39 +735,57 @@ class I2cTransmit:
             return False
 
         c = 0
-        self.log.info("i2cSpeedtest: Starting test!")
+        errors = 0
+        attempts = 0
+        self.log.info("i2cSpeedtest: Starting test with transport " +
+                      self.transport + "!")
         start = self._now()
         for ledstatus in [self.LED_ON, self.LED_OFF]:
-            for keyid in range(0, 256):
+            for keyid in keyids:
                 for keyaction in [self.KEY_TEST, self.KEY_PRESS,
                                   self.KEY_RELEASE, self.KEY_RELEASEALL]:
                     ok = False
                     retry = 0
-                    while not ok and retry < 10:
-                        ok = self.keyAction(keyid, keyaction, ledstatus)
+                    while not ok and retry < self.retries:
+                        # every action has to reach the bus to be counted
+                        ret = self.keyAction(keyid, keyaction, ledstatus,
+                                             force=True)
+                        ok = ret is not False and ret[0]
                         retry += 1
+                        attempts += 1
                         if not ok:
-                            time.sleep(0.1)
+                            errors += 1
+                            time.sleep(self.retry_delay)
                     if ok:
                         c += 1
+                    if keyaction == self.KEY_PRESS:
+                        if hold > 0:
+                            time.sleep(hold)
+                    elif gap > 0:
+                        time.sleep(gap)
         stop = self._now()
         self.log.info("i2cSpeedtest: Test duration: %.2f ms", (stop - start))
         self.log.info("i2cSpeedtest: Performed %.0f successfull transmissions",
                       c)
+        self.log.info("i2cSpeedtest: %.0f of %.0f attempts failed",
+                      errors, attempts)
         if c > 0:
             self.log.info("i2cSpeedtest: %.2f ms/keyaction",
                           (stop - start) * 1.00 / c)
             self.log.info("i2cSpeedtest: %.2f keyactions/s",
                           (1 / ((stop - start) * 1.00 / c / 1000)))
-        return
+        return {"count": c, "errors": errors, "attempts": attempts,
+                "duration": stop - start, "transport": self.transport}
 
-    def sendText(self, text):
+    def sendText(self, text, layout=None):
         '''
         Translate the given text into keyboard events and create them
         via the i2c interface.
 
         Keyword arguments:
             text -- text to send / write with the keyboard
+            layout -- name of the target keyboard layout for this call
+                      (default: layout of this object)
         '''
 
         if not self.is_keyboard:
@@ -367,22 +793,35 @@ class I2cTransmit:
                              "verify that an Arduino Keyboard is connected!")
             return False
 
+        if layout is None:
+            key_map = self.layout.forward
+        else:
+            key_map = keymap.loadLayout(layout).forward
+
         for char in text:
             keylist = ()
             try:
-                keylist = KEY_MAP[char]
+                keylist = key_map[char]
             except:
                 self.log.warning("sendText: Could not find '" + char + "' " +
-                                 "in KEY_MAP!")
+                                 "in keyboard layout!")
                 continue
 
             if not isinstance(keylist, tuple):
                 continue
 
+            # in report mode modifiers are sent together with the next key
+            chord = []
             for key in keylist:
-                self.press(key)
-                time.sleep(0.001)
+                chord.append(key)
+                if self.report_mode and key in HID_MODIFIER:
+                    continue
+                self.pressKeys(chord)
+                chord = []
+                time.sleep(self.hold_time)
+            if chord:
+                self.pressKeys(chord)
             self.releaseAll()
-            time.sleep(0.001)
+            time.sleep(self.frame_gap)
 
         return
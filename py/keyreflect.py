@@ -0,0 +1,356 @@
+# vim: set fileencoding=utf-8
+
+import os
+import sys
+import codecs
+import select
+import termios
+import threading
+import time
+import tty
+import logging
+
+from keymap import MODIFIERS
+
+ALIGN_MATCH = 0
+ALIGN_DROP = 1       # expected character never arrived
+ALIGN_INSERT = 2     # character arrived that was never sent
+ALIGN_SUBSTITUTE = 3  # a different character arrived in place of the sent one
+
+
+def align(expected, received, band=32, max_gap=128):
+    '''
+    Align received text against expected text with a banded edit distance
+    (Needleman-Wunsch with unit costs) and return the list of differences.
+
+    Keyword arguments:
+        expected -- text that has been injected
+        received -- text that has been read back
+        band -- number of diagonals around the main diagonal to search,
+                widened automatically by the length difference
+        max_gap -- largest length difference aligned as a whole; beyond
+                   it, the tail of the longer text is reported as one
+                   block of drops (or inserts), so a stalled reader does
+                   not make the alignment quadratic
+    returns list of (kind, expected position, received position,
+                     expected char, received char) tuples, kind being one
+                     of "drop", "duplicate", "insert" or "substitute"
+    '''
+    n = len(expected)
+    m = len(received)
+    if n - m > max_gap:
+        cut = m + max_gap
+        return align(expected[:cut], received, band, max_gap) + \
+            [("drop", i, m, expected[i], None) for i in range(cut, n)]
+    if m - n > max_gap:
+        cut = n + max_gap
+        return align(expected, received[:cut], band, max_gap) + \
+            [("insert", n, j, None, received[j]) for j in range(cut, m)]
+    k = abs(n - m) + band
+
+    # cost and traceback rows only cover the band [lo, hi] of each row
+    lows = []
+    trace = []
+    prev = list(range(0, min(m, k) + 1))
+    prev_lo = 0
+    lows.append(0)
+    trace.append(bytearray([ALIGN_INSERT] * len(prev)))
+    big = n + m + 1
+
+    for i in range(1, n + 1):
+        lo = max(0, i - k)
+        hi = min(m, i + k)
+        row = [big] * (hi - lo + 1)
+        back = bytearray(hi - lo + 1)
+        a = expected[i - 1]
+        for j in range(lo, hi + 1):
+            best = big
+            step = ALIGN_MATCH
+            p = j - prev_lo
+            # diagonal: match or substitution
+            if j > 0 and 0 <= p - 1 < len(prev):
+                best = prev[p - 1] + (0 if a == received[j - 1] else 1)
+                step = ALIGN_MATCH if a == received[j - 1] \
+                    else ALIGN_SUBSTITUTE
+            # up: expected char dropped
+            if 0 <= p < len(prev) and prev[p] + 1 < best:
+                best = prev[p] + 1
+                step = ALIGN_DROP
+            # left: extra char received
+            if j > lo and row[j - lo - 1] + 1 < best:
+                best = row[j - lo - 1] + 1
+                step = ALIGN_INSERT
+            row[j - lo] = best
+            back[j - lo] = step
+        lows.append(lo)
+        trace.append(back)
+        prev = row
+        prev_lo = lo
+
+    # walk back from the bottom right corner
+    ops = []
+    i = n
+    j = m
+    while i > 0 or j > 0:
+        if i == 0:
+            step = ALIGN_INSERT
+        else:
+            step = trace[i][j - lows[i]]
+        if step == ALIGN_MATCH:
+            i -= 1
+            j -= 1
+        elif step == ALIGN_SUBSTITUTE:
+            ops.append(("substitute", i - 1, j - 1,
+                        expected[i - 1], received[j - 1]))
+            i -= 1
+            j -= 1
+        elif step == ALIGN_DROP:
+            ops.append(("drop", i - 1, j, expected[i - 1], None))
+            i -= 1
+        else:
+            c = received[j - 1]
+            kind = "insert"
+            if (j > 1 and received[j - 2] == c) or \
+                    (j < m and received[j] == c) or \
+                    (i > 0 and expected[i - 1] == c):
+                kind = "duplicate"
+            ops.append((kind, i, j - 1, None, c))
+            j -= 1
+    ops.reverse()
+    return ops
+
+
+class KeyDecoder:
+    '''
+    Decode key events of a looped back keyboard into the characters the
+    target sees, using the reverse indexes of a compiled Layout.
+    '''
+
+    UNKNOWN = '\ufffd'
+
+    def __init__(self, layout):
+        '''
+        Initialize KeyDecoder Object
+
+        Keyword arguments:
+            layout -- keymap.Layout of the target
+        '''
+        self.layout = layout
+        self.deadkeys = set(seq[0] for seq in layout.dead)
+        self.held = {}            # held modifier key -> modifier bit
+        self.pending = None       # stroke of a pressed dead key
+
+    def feed(self, code, value):
+        '''
+        Process one key event
+
+        Keyword arguments:
+            code -- evdev key code
+            value -- 1 key down, 0 key up, 2 autorepeat
+        returns decoded character or None
+        '''
+        if code in MODIFIERS:
+            if value:
+                self.held[code] = MODIFIERS[code]
+            else:
+                self.held.pop(code, None)
+            return None
+        if value != 1:
+            return None
+
+        mods = 0
+        for bit in self.held.values():
+            mods |= bit
+        stroke = (code, mods)
+
+        if self.pending is not None:
+            char = self.layout.dead.get((self.pending, stroke), self.UNKNOWN)
+            self.pending = None
+            return char
+        if stroke in self.deadkeys:
+            self.pending = stroke
+            return None
+        return self.layout.reverse.get(stroke, self.UNKNOWN)
+
+
+class StreamVerifier:
+    '''
+    Inject a corpus continuously through an I2cTransmit object while a
+    concurrent reader consumes the loopback input (the Arduino plugged into
+    the pi itself) and report sustained throughput and transmission errors.
+    The loopback input is either stdin or the evdev device of the Arduino,
+    which is decoded with the layout of the keyboard object.
+    '''
+
+    def __init__(self, keyboard, idle_timeout=2.0, device=None):
+        '''
+        Initialize StreamVerifier Object
+
+        Keyword arguments:
+            keyboard -- I2cTransmit object used for injection
+            idle_timeout -- seconds without input after injection finished
+                            before the reader gives up
+            device -- evdev input device of the looped back Arduino
+                      (None: read from stdin)
+        '''
+        self.keyboard = keyboard
+        self.idle_timeout = idle_timeout
+        self.device = device
+        self.log = logging.getLogger(__name__)
+        self.received = []        # received characters
+        self.first_rx = None      # time of first received character
+        self.last_rx = None       # time of last received character
+        self.sending = False      # True while the corpus is injected
+
+    def expectedText(self, corpus):
+        '''
+        Reduce corpus to the characters sendText is able to transmit
+        '''
+        key_map = self.keyboard.layout.forward
+        return "".join(c for c in corpus if c in key_map)
+
+    def _readStdin(self, expected_len):
+        '''Reader thread: collect characters from raw stdin'''
+        fd = sys.stdin.fileno()
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        idle_since = time.time()
+        while len(self.received) < expected_len:
+            (r, w, x) = select.select([fd], [], [], 0.05)
+            now = time.time()
+            if not r:
+                if not self.sending and \
+                        now - idle_since > self.idle_timeout:
+                    break
+                continue
+            data = decoder.decode(os.read(fd, 4096))
+            if not data:
+                continue
+            if self.first_rx is None:
+                self.first_rx = now
+            self.last_rx = now
+            idle_since = now
+            # enter arrives as carriage return on a raw terminal
+            self.received.extend('\n' if c == '\r' else c for c in data)
+
+    def _readDevice(self, expected_len):
+        '''Reader thread: decode characters from the evdev device'''
+        decoder = KeyDecoder(self.keyboard.layout)
+        idle_since = time.time()
+        while len(self.received) < expected_len:
+            (r, w, x) = select.select([self.device.fd], [], [], 0.05)
+            now = time.time()
+            if not r:
+                if not self.sending and \
+                        now - idle_since > self.idle_timeout:
+                    break
+                continue
+            for event in self.device.read():
+                if event.type != 1:
+                    continue
+                char = decoder.feed(event.code, event.value)
+                if char is None:
+                    continue
+                if self.first_rx is None:
+                    self.first_rx = now
+                self.last_rx = now
+                idle_since = now
+                self.received.append(char)
+
+    def run(self, corpus):
+        '''
+        Send corpus and read it back concurrently
+
+        Keyword arguments:
+            corpus -- text to inject
+        returns dictionary with throughput and error statistics
+        '''
+        expected = self.expectedText(corpus)
+        self.received = []
+        self.first_rx = None
+        self.last_rx = None
+
+        if self.device is not None:
+            self.device.grab()
+            try:
+                start, stop_tx = self._inject(expected, self._readDevice)
+            finally:
+                self.device.ungrab()
+        else:
+            fd = sys.stdin.fileno()
+            old_set = termios.tcgetattr(fd)
+            try:
+                tty.setraw(fd)
+                start, stop_tx = self._inject(expected, self._readStdin)
+            finally:
+                termios.tcsetattr(fd, termios.TCSADRAIN, old_set)
+            termios.tcflush(fd, termios.TCIOFLUSH)
+
+        return self.report(expected, "".join(self.received),
+                           start, stop_tx)
+
+    def _inject(self, expected, reader):
+        '''
+        Send expected text while reader runs in its own thread
+
+        returns (start, stop) time of the injection
+        '''
+        self.sending = True
+        thread = threading.Thread(target=reader, args=(len(expected),))
+        thread.start()
+        start = time.time()
+        try:
+            self.keyboard.sendText(expected)
+        finally:
+            stop_tx = time.time()
+            self.sending = False
+            thread.join()
+        return (start, stop_tx)
+
+    def report(self, expected, received, start, stop_tx):
+        '''
+        Align received against expected text and collect statistics
+
+        returns dictionary with throughput and error statistics
+        '''
+        ops = align(expected, received)
+        counts = {"drop": 0, "duplicate": 0, "insert": 0, "substitute": 0}
+        for op in ops:
+            counts[op[0]] += 1
+
+        stop = self.last_rx if self.last_rx is not None else stop_tx
+        duration = stop - start
+        errors = len(ops)
+        result = {
+            "sent": len(expected),
+            "received": len(received),
+            "duration": duration,
+            "tx_duration": stop_tx - start,
+            "keys_per_s": len(received) / duration if duration > 0 else 0,
+            "errors": errors,
+            "error_rate": errors / len(expected) if expected else 0,
+            "counts": counts,
+            "ops": ops,
+        }
+        return result
+
+    def logReport(self, result, max_ops=50):
+        '''Write a human readable version of the report to the log'''
+        self.log.info("Sent " + str(result["sent"]) + " chars, received " +
+                      str(result["received"]) + " chars in " +
+                      "%.2f" % result["duration"] + " s")
+        self.log.info("Sustained throughput: %.2f keys/s",
+                      result["keys_per_s"])
+        self.log.info("Errors: " + str(result["errors"]) +
+                      " (error rate %.4f%%)" % (result["error_rate"] * 100) +
+                      " drops: " + str(result["counts"]["drop"]) +
+                      " duplicates: " + str(result["counts"]["duplicate"]) +
+                      " inserts: " + str(result["counts"]["insert"]) +
+                      " substitutions: " +
+                      str(result["counts"]["substitute"]))
+        for (kind, epos, rpos, echr, rchr) in result["ops"][:max_ops]:
+            self.log.info(kind + " at sent pos " + str(epos) +
+                          " / received pos " + str(rpos) + ": " +
+                          repr(echr) + " -> " + repr(rchr))
+        if len(result["ops"]) > max_ops:
+            self.log.info("... " + str(len(result["ops"]) - max_ops) +
+                          " more differences")
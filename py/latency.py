@@ -0,0 +1,142 @@
+import math
+import logging
+
+
+class LatencyHistogram:
+    '''
+    Logarithmic latency histogram with constant time recording.
+    Buckets are spaced by a factor of 2^(1/resolution) starting at 1
+    microsecond, so percentiles are accurate to a few percent.
+    '''
+
+    def __init__(self, resolution=8, max_seconds=10.0):
+        '''
+        Initialize LatencyHistogram Object
+
+        Keyword arguments:
+            resolution -- buckets per doubling of the latency
+            max_seconds -- latencies above this end up in the last bucket
+        '''
+        self.resolution = resolution
+        self.size = int(math.log2(max_seconds * 1e6) * resolution) + 2
+        self.buckets = [0] * self.size
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        '''
+        Add one latency sample
+
+        Keyword arguments:
+            seconds -- latency in seconds
+        '''
+        us = seconds * 1e6
+        if us < 1:
+            idx = 0
+        else:
+            idx = int(math.log2(us) * self.resolution) + 1
+            if idx >= self.size:
+                idx = self.size - 1
+        self.buckets[idx] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def reset(self):
+        '''Drop all samples'''
+        self.buckets = [0] * self.size
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def percentile(self, p):
+        '''
+        Latency below which p percent of the samples are
+
+        returns latency in seconds (upper bound of the bucket) or None
+        '''
+        if self.count == 0:
+            return None
+        rank = self.count * p / 100.0
+        seen = 0
+        for idx, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                if idx == 0:
+                    return 1e-6
+                return min(2 ** (idx / self.resolution) / 1e6, self.max)
+        return self.max
+
+    def mean(self):
+        '''returns mean latency in seconds or None'''
+        if self.count == 0:
+            return None
+        return self.total / self.count
+
+    def summary(self):
+        '''returns one line summary of the histogram in milliseconds'''
+        if self.count == 0:
+            return "no samples"
+        return ("n=%d mean=%.3f ms p50=%.3f ms p90=%.3f ms p99=%.3f ms " +
+                "max=%.3f ms") % (self.count, self.mean() * 1000,
+                                  self.percentile(50) * 1000,
+                                  self.percentile(90) * 1000,
+                                  self.percentile(99) * 1000,
+                                  self.max * 1000)
+
+
+class LatencyTracker:
+    '''
+    Track input to confirm latency of forwarded key events over the whole
+    run and over the current check window and raise an SLO alarm, when the
+    p99 latency of a window exceeds the configured threshold.
+    '''
+
+    def __init__(self, slo_p99=None, min_samples=20):
+        '''
+        Initialize LatencyTracker Object
+
+        Keyword arguments:
+            slo_p99 -- p99 latency threshold in seconds (None: no alarm)
+            min_samples -- minimum samples in a window to evaluate the SLO
+        '''
+        self.log = logging.getLogger(__name__)
+        self.slo_p99 = slo_p99
+        self.min_samples = min_samples
+        self.total = LatencyHistogram()
+        self.window = LatencyHistogram()
+        self.alarm = False        # True while the SLO is violated
+
+    def record(self, seconds):
+        '''
+        Record latency of one event
+
+        Keyword arguments:
+            seconds -- time from input event to confirmed delivery
+        '''
+        self.total.record(seconds)
+        self.window.record(seconds)
+
+    def checkSlo(self):
+        '''
+        Evaluate the current window against the SLO and start a new window
+
+        returns True, when the SLO is violated
+        '''
+        if self.slo_p99 is None or self.window.count < self.min_samples:
+            return self.alarm
+
+        p99 = self.window.percentile(99)
+        if p99 > self.slo_p99:
+            self.log.warning("checkSlo: p99 latency %.3f ms exceeds SLO " +
+                             "of %.3f ms! (%s)", p99 * 1000,
+                             self.slo_p99 * 1000, self.window.summary())
+            self.alarm = True
+        elif self.alarm:
+            self.log.info("checkSlo: p99 latency %.3f ms back within SLO " +
+                          "of %.3f ms", p99 * 1000, self.slo_p99 * 1000)
+            self.alarm = False
+        self.window.reset()
+        return self.alarm
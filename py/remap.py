@@ -0,0 +1,174 @@
+import os
+import json
+import asyncio
+import logging
+
+from keyevents import KEY_EVENTS
+
+KEY_BLOCKED = -1    # table entry for keys that are never forwarded
+KEY_LAYER = -2      # table entry for keys that switch layers
+
+
+class RemapEngine:
+    '''
+    Remap key codes before they are forwarded to the Arduino Micro.
+
+    The JSON configuration (see remap.example.json) is compiled into one
+    flat 256 entry table per layer, so translating an event is a single
+    index operation. Layers are active while their layer key is held,
+    keys missing in a layer fall through to the "base" layer. The
+    configuration file is watched and recompiled on change; the compiled
+    tables are swapped in with one assignment, so events are never lost.
+    '''
+
+    def __init__(self, path=None):
+        '''
+        Initialize RemapEngine Object
+
+        Keyword arguments:
+            path -- JSON configuration file (None: no remapping)
+        '''
+        self.log = logging.getLogger(__name__)
+        self.path = path
+        self.stamp = None               # (mtime, size) of loaded config
+        self.compiled = self.compile({})
+        self.held_layers = []           # (key, layer index) of held layer keys
+        self.layer = 0                  # currently active layer
+        self.down = [None] * 256        # output code of each pressed key
+        if path is not None:
+            self.reload()
+
+    def keyCode(self, name):
+        '''
+        Resolve key name ("KEY_A") or number to key code
+
+        returns key code
+        '''
+        if isinstance(name, int):
+            code = name
+        elif name in KEY_EVENTS:
+            code = KEY_EVENTS[name]
+        else:
+            raise ValueError("unknown key '" + str(name) + "'")
+        if code < 0 or code > 255:
+            raise ValueError("key code " + str(code) + " out of range")
+        return code
+
+    def compile(self, config):
+        '''
+        Compile a configuration into lookup tables
+
+        Keyword arguments:
+            config -- dictionary with "layers" (layer name -> {key: key or
+                      null}) and "layerkeys" (key -> layer name)
+        returns (tables, layerkeys) with one 256 entry table per layer
+                and a 256 entry table of layer indices per key
+        '''
+        layers = config.get("layers", {})
+        names = ["base"] + sorted(n for n in layers if n != "base")
+
+        base = list(range(256))
+        for (src, dst) in layers.get("base", {}).items():
+            base[self.keyCode(src)] = KEY_BLOCKED if dst is None \
+                else self.keyCode(dst)
+
+        tables = [base]
+        for name in names[1:]:
+            table = list(base)
+            for (src, dst) in layers[name].items():
+                table[self.keyCode(src)] = KEY_BLOCKED if dst is None \
+                    else self.keyCode(dst)
+            tables.append(table)
+
+        layerkeys = [0] * 256
+        for (key, name) in config.get("layerkeys", {}).items():
+            if name not in names or name == "base":
+                raise ValueError("unknown layer '" + str(name) + "'")
+            code = self.keyCode(key)
+            layerkeys[code] = names.index(name)
+            for table in tables:
+                table[code] = KEY_LAYER
+
+        return (tables, layerkeys)
+
+    def reload(self):
+        '''
+        Load and compile the configuration file and activate it.
+        On errors the previous configuration stays active.
+
+        returns True, when a new configuration has been activated
+        '''
+        try:
+            st = os.stat(self.path)
+            self.stamp = (st.st_mtime_ns, st.st_size)
+            with open(self.path, encoding="utf-8") as f:
+                compiled = self.compile(json.load(f))
+        except (OSError, ValueError, KeyError, TypeError,
+                AttributeError) as e:
+            self.log.error("reload: failed to load remap configuration " +
+                           str(self.path) + ": " + str(e))
+            return False
+
+        self.compiled = compiled
+        if self.layer >= len(compiled[0]):
+            self.held_layers = []
+            self.layer = 0
+        self.log.info("reload: activated remap configuration " +
+                      str(self.path) + " with " + str(len(compiled[0])) +
+                      " layer(s)")
+        return True
+
+    def changed(self):
+        '''returns True, when the configuration file changed on disk'''
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False
+        return (st.st_mtime_ns, st.st_size) != self.stamp
+
+    async def watch(self, interval=1.0):
+        '''
+        Poll the configuration file and reload it on change
+
+        Keyword arguments:
+            interval -- seconds between two checks
+        '''
+        while True:
+            await asyncio.sleep(interval)
+            if self.changed():
+                try:
+                    self.reload()
+                except Exception:
+                    self.log.exception("watch: Unexpected error!")
+
+    def map(self, code, value):
+        '''
+        Translate one key event
+
+        Keyword arguments:
+            code -- evdev key code
+            value -- 1 for key down, 0 for key up
+        returns key code to forward or a negative number, if the event
+                is consumed
+        '''
+        if code > 255:
+            return code
+        (tables, layerkeys) = self.compiled
+        if value == 1:
+            out = tables[self.layer][code]
+            if out == KEY_LAYER:
+                self.held_layers.append((code, layerkeys[code]))
+                self.layer = layerkeys[code]
+            self.down[code] = out
+            return out
+
+        # release the code that has been pressed, even if the layer or
+        # the configuration changed in between
+        out = self.down[code]
+        if out is None:
+            out = tables[self.layer][code]
+        self.down[code] = None
+        if out == KEY_LAYER:
+            self.held_layers = [h for h in self.held_layers if h[0] != code]
+            self.layer = self.held_layers[-1][1] if self.held_layers else 0
+        return out
@@ -0,0 +1,182 @@
+import time
+import logging
+import threading
+from collections import deque
+
+from latency import LatencyHistogram
+
+
+class TransmitScheduler:
+    '''
+    Arbitrate one I2cTransmit object between live key events and bulk text
+    injection. A worker thread owns the transmitter and always prefers
+    interactive work. Bulk text is split into one unit per character, each
+    ending with all keys released, and bulk units only start when no keys
+    are held, so a preempted paste never leaves keys pressed in between.
+
+    Fairness: while bulk work is waiting, at most bulk_share interactive
+    units run in a row and a bulk unit waiting longer than max_bulk_wait
+    runs at the next safe point.
+    '''
+
+    INTERACTIVE = 0
+    BULK = 1
+    CLASSES = ["interactive", "bulk"]
+
+    def __init__(self, keyboard, bulk_share=16, max_bulk_wait=0.25):
+        '''
+        Initialize TransmitScheduler Object
+
+        Keyword arguments:
+            keyboard -- I2cTransmit object, only used by the worker thread
+                        once the scheduler is started
+            bulk_share -- interactive units in a row before a waiting bulk
+                          unit is served
+            max_bulk_wait -- seconds after which a waiting bulk unit is
+                             served before further interactive units
+        '''
+        self.log = logging.getLogger(__name__)
+        self.keyboard = keyboard
+        self.bulk_share = bulk_share
+        self.max_bulk_wait = max_bulk_wait
+        self.cond = threading.Condition()
+        self.queues = [deque(), deque()]
+        self.metrics = [LatencyHistogram(), LatencyHistogram()]
+        self.streak = 0           # interactive units run in a row
+        self.last_bulk = 0        # time bulk work was last served
+        self.busy = False         # True while the worker runs a unit
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        '''Start the worker thread'''
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        '''
+        Process all queued work and stop the worker thread
+
+        Keyword arguments:
+            timeout -- seconds to wait for the queues to drain
+        '''
+        self.flush(timeout)
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+
+    def flush(self, timeout=None):
+        '''
+        Wait until all queued work has been transmitted
+
+        returns True, when the queues are empty
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        with self.cond:
+            while self.queues[0] or self.queues[1] or self.busy:
+                remaining = None if deadline is None \
+                    else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+        return True
+
+    def submit(self, cls, func, *args):
+        '''
+        Queue one unit of work
+
+        Keyword arguments:
+            cls -- INTERACTIVE or BULK
+            func -- callable run by the worker thread
+            args -- arguments for func
+        '''
+        with self.cond:
+            self.queues[cls].append((time.time(), func, args))
+            self.cond.notify_all()
+
+    def keyAction(self, keyid, action, led, timestamp=None):
+        '''Queue a live key event (see I2cTransmit.keyAction)'''
+        self.submit(self.INTERACTIVE, self.keyboard.keyAction,
+                    keyid, action, led, timestamp)
+        return True
+
+    def releaseAll(self):
+        '''Queue releasing all keys as interactive work'''
+        self.submit(self.INTERACTIVE, self.keyboard.releaseAll)
+        return True
+
+    def setAddress(self, address):
+        '''Queue switching the target address as interactive work'''
+        self.submit(self.INTERACTIVE, self.keyboard.setAddress, address)
+        return True
+
+    def sendText(self, text, layout=None):
+        '''Queue text injection as preemptible bulk work'''
+        with self.cond:
+            now = time.time()
+            if not self.queues[self.BULK]:
+                self.last_bulk = now
+            for char in text:
+                self.queues[self.BULK].append(
+                    (now, self.keyboard.sendText, (char, layout)))
+            self.cond.notify_all()
+        return True
+
+    def pressedKeys(self):
+        '''returns a list of currently pressed keys'''
+        return self.keyboard.pressedKeys()
+
+    def _next(self):
+        '''
+        Pick the next unit to run, called with self.cond held
+
+        returns (class, unit) or None, if nothing can run now
+        '''
+        interactive = self.queues[self.INTERACTIVE]
+        bulk = self.queues[self.BULK]
+        safe = not self.keyboard.pressedKeys()
+
+        if bulk and safe:
+            now = time.time()
+            starved = self.streak >= self.bulk_share or \
+                now - self.last_bulk > self.max_bulk_wait
+            if not interactive or starved:
+                self.streak = 0
+                self.last_bulk = now
+                return (self.BULK, bulk.popleft())
+        if interactive:
+            self.streak += 1 if bulk else 0
+            return (self.INTERACTIVE, interactive.popleft())
+        return None
+
+    def _run(self):
+        '''Worker thread: transmit queued units by priority'''
+        while True:
+            with self.cond:
+                job = self._next()
+                while job is None:
+                    if not self.running:
+                        return
+                    # bulk work waits for held keys to be released
+                    self.cond.wait(0.01 if self.queues[self.BULK] else None)
+                    job = self._next()
+                self.busy = True
+
+            (cls, (queued, func, args)) = job
+            self.metrics[cls].record(time.time() - queued)
+            try:
+                func(*args)
+            except Exception as e:
+                self.log.exception("_run: Unexpected error!")
+
+            with self.cond:
+                self.busy = False
+                self.cond.notify_all()
+
+    def summary(self):
+        '''returns list of one line queue latency summaries per class'''
+        return [name + " queue latency: " + hist.summary()
+                for (name, hist) in zip(self.CLASSES, self.metrics)]
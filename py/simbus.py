@@ -0,0 +1,220 @@
+import time
+import random
+import logging
+
+
+class SimMsg:
+    '''
+    Message of a combined transaction, mirrors smbus2.i2c_msg
+    '''
+
+    def __init__(self, address, read, buf):
+        self.addr = address
+        self.read_flag = read
+        self.buf = buf
+        self.len = len(buf)
+
+    @staticmethod
+    def read(address, length):
+        '''returns message reading length bytes'''
+        return SimMsg(address, True, [0] * length)
+
+    @staticmethod
+    def write(address, buf):
+        '''returns message writing the bytes of buf'''
+        return SimMsg(address, False, list(buf))
+
+    def __iter__(self):
+        return iter(self.buf)
+
+    def __len__(self):
+        return self.len
+
+
+class SimBus:
+    '''
+    Simulated i2c bus with an i2ckeyboard Arduino Micro attached. Mirrors
+    the smbus.SMBus methods used by I2cTransmit and the protocol handling
+    of i2ckeyboard.ino, with configurable timing and faults:
+
+        op_time -- seconds each bus transaction takes
+        settle -- seconds the Arduino is busy after a confirm read
+        key_settle -- seconds the Arduino is busy after a key press or
+                      release (sending the HID report, only with the
+                      hardware switch on)
+        early_fault -- probability that a transaction issued while the
+                       Arduino is busy gets a bit flipped
+        bit_error -- probability of a bit flip per transaction
+        nack -- probability of a transaction failing with OSError
+        switch -- status of the hardware switch
+        seed -- random seed for reproducible faults
+    '''
+
+    DEVICE_ID = 0b10000010
+    REPORT_ID = 0b11111111
+
+    i2c_msg = SimMsg          # message class for i2c_rdwr
+
+    def __init__(self, op_time=0.0001, settle=0.0002, key_settle=0.001,
+                 early_fault=0.3, bit_error=0.0001, nack=0.0001,
+                 switch=False, seed=None):
+        self.log = logging.getLogger(__name__)
+        self.op_time = op_time
+        self.settle = settle
+        self.key_settle = key_settle
+        self.early_fault = early_fault
+        self.bit_error = bit_error
+        self.nack = nack
+        self.switch = switch
+        self.random = random.Random(seed)
+
+        self.keyid = 0
+        self.action = 0
+        self.led = False
+        self.report_confirm = None
+        self.nothing_received_since_restart = True
+        self.busy_until = 0
+        self.pressed = set()      # keys pressed on the simulated HID
+        self.transactions = 0     # number of bus transactions
+        self.faults = 0           # number of injected faults
+
+    def _bitSum(self, data):
+        '''returns number of bits = 1 in data'''
+        return bin(data).count("1")
+
+    def _transaction(self):
+        '''Account one bus transaction, may fail with OSError'''
+        self.transactions += 1
+        if self.op_time > 0:
+            time.sleep(self.op_time)
+        if self.random.random() < self.nack:
+            self.faults += 1
+            raise OSError(121, "Remote I/O error (simulated)")
+
+    def _corrupt(self, data):
+        '''
+        Inject bit errors into one transferred byte, more likely while the
+        Arduino is busy
+
+        returns data, possibly with a flipped bit
+        '''
+        p = self.bit_error
+        if time.time() < self.busy_until:
+            p = p + self.early_fault
+        if self.random.random() < p:
+            self.faults += 1
+            data = data ^ (1 << self.random.randrange(8))
+        return data
+
+    def _receive(self, data):
+        '''receiveData() of the firmware for one byte'''
+        self.report_confirm = None
+        self.keyid = self.action
+        self.action = data
+        self.nothing_received_since_restart = False
+
+    def _check(self):
+        '''check() of the firmware, returns confirmation byte'''
+        keyid = self.keyid
+        action = self.action
+        checkinput = self._bitSum(keyid) + self._bitSum(action & 0b11110000)
+        confirmsum = self._bitSum(keyid) + self._bitSum(action)
+        if checkinput != (action & 0b00001111) or checkinput % 2 == 0:
+            confirmsum |= 0b01000000
+        if self.switch:
+            confirmsum |= 0b00100000
+        if self.led:
+            confirmsum |= 0b00010000
+        if self._bitSum(confirmsum) % 2 == 0:
+            confirmsum |= 0b10000000
+        return confirmsum & 0xFF
+
+    def _send(self):
+        '''sendData() of the firmware, returns the byte sent'''
+        if self.nothing_received_since_restart:
+            return self.DEVICE_ID
+        if self.report_confirm is not None:
+            confirm = self.report_confirm
+            self.report_confirm = None
+            return confirm
+        if self.action == 0 and self.keyid == 0:
+            return self.DEVICE_ID
+
+        confirm = self._check()
+        busy = self.settle
+        if not confirm & 0b01000000:
+            # HID reports are only sent with the hardware switch on
+            kind = self.action & 0b00110000
+            if self.switch and kind != 0b00000000:
+                busy = max(busy, self.key_settle)
+                if kind == 0b00010000:
+                    self.pressed.add(self.keyid)
+                elif kind == 0b00100000:
+                    self.pressed.discard(self.keyid)
+                else:
+                    self.pressed = set()
+            self.led = bool(self.action & 0b01000000)
+            self.action = 0
+            self.keyid = 0
+        self.busy_until = time.time() + busy
+        return confirm
+
+    def _report(self, data):
+        '''applyReport() of the firmware, returns confirmation byte'''
+        checkinput = sum(self._bitSum(b) for b in data[:-1])
+        check = data[-1]
+        confirmsum = (checkinput + self._bitSum(check)) & 0b00001111
+        if checkinput != (check & 0b00111111) or \
+                self._bitSum(check) % 2 == 0:
+            confirmsum |= 0b01000000
+        else:
+            if self.switch:
+                self.pressed = set(b for b in data[1:-1] if b)
+                self.busy_until = time.time() + self.key_settle
+            self.led = bool(check & 0b01000000)
+        if self.switch:
+            confirmsum |= 0b00100000
+        if self.led:
+            confirmsum |= 0b00010000
+        if self._bitSum(confirmsum) % 2 == 0:
+            confirmsum |= 0b10000000
+        return confirmsum
+
+    def write_byte(self, address, data):
+        '''smbus.SMBus.write_byte'''
+        self._transaction()
+        self._receive(self._corrupt(data))
+
+    def read_byte(self, address):
+        '''smbus.SMBus.read_byte'''
+        self._transaction()
+        flip = self._corrupt(0)   # bit error on the line while reading
+        return self._send() ^ flip
+
+    def _write(self, frame):
+        '''receiveData() of the firmware for a multi byte write'''
+        self.nothing_received_since_restart = False
+        if len(frame) == 9 and frame[0] == self.REPORT_ID:
+            self.report_confirm = self._report(frame[1:])
+        else:
+            for b in frame:
+                self._receive(b)
+
+    def write_i2c_block_data(self, address, command, data):
+        '''smbus.SMBus.write_i2c_block_data'''
+        self._transaction()
+        self._write([self._corrupt(b) for b in [command] + list(data)])
+
+    def i2c_rdwr(self, *msgs):
+        '''
+        smbus2.SMBus.i2c_rdwr, all messages are one transaction joined by
+        repeated starts
+        '''
+        self._transaction()
+        for msg in msgs:
+            if msg.read_flag:
+                for n in range(msg.len):
+                    flip = self._corrupt(0)
+                    msg.buf[n] = self._send() ^ flip
+            else:
+                self._write([self._corrupt(b) for b in msg.buf])